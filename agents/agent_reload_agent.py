@@ -3,6 +3,8 @@ from __future__ import annotations
 
 from typing import Any, Dict
 
+import core.agents_base as agents_base
+from core import agent_loader
 from core.agents_base import Agent, AgentResult
 from core.models import (
     EmotionalState,
@@ -14,6 +16,11 @@ from core.models import (
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
 
+DEFAULT_PACKAGES = ("agents", "r_agents")
+
+PENDING_RELOAD_KEY = "pending_agent_reload"
+PENDING_RELOAD_CONTENT = "Agent reload richiesto; effettuare reload all'avvio."
+
 
 class AgentReloadAgent(Agent):
     """
@@ -34,7 +41,7 @@ class AgentReloadAgent(Agent):
     Parametri input_payload:
       - mode: "runtime" | "next_restart" (default: "runtime")
       - dry_run: bool (default False)
-      - packages: lista di package da scandire (default ["agents", "r_agents"])
+      - packages: lista di package da scandire (default DEFAULT_PACKAGES)
     """
 
     name = "agent_reload_agent"
@@ -50,10 +57,10 @@ class AgentReloadAgent(Agent):
     ) -> AgentResult:
         mode = input_payload.get("mode", "runtime")
         dry_run = bool(input_payload.get("dry_run", False))
-        packages = input_payload.get("packages") or ["agents", "r_agents"]
+        packages = input_payload.get("packages") or DEFAULT_PACKAGES
 
-        # messaggi da restituire all'utente
-        messages: list[str] = []
+        # messaggi da restituire all'utente (header incluso, join unico alla fine)
+        messages: list[str] = ["🔄 AgentReloadAgent", ""]
 
         # ----------------------------------------------------------
         # 1) Tentativo di runtime reload (se richiesto)
@@ -63,32 +70,33 @@ class AgentReloadAgent(Agent):
         num_after = None
 
         if mode == "runtime" and not dry_run:
-            try:
-                # Importiamo loader e cerchiamo un registry globale opzionale
-                from core import agent_loader  # type: ignore
-                import core.agents_base as agents_base  # type: ignore
+            # Cerchiamo un registry globale opzionale (letto a ogni chiamata:
+            # main.py lo imposta dopo l'import degli agent)
+            registry = getattr(agents_base, "ACTIVE_REGISTRY", None)
+            list_agents = getattr(registry, "list_agents", None)
 
-                registry = getattr(agents_base, "ACTIVE_REGISTRY", None)
-
-                if registry is None:
-                    messages.append(
-                        "⚠️ Nessun ACTIVE_REGISTRY trovato in core.agents_base; "
-                        "non posso ricaricare gli agent a runtime."
-                    )
-                else:
-                    # conteggio prima
-                    if hasattr(registry, "list_agents"):
-                        num_before = len(registry.list_agents())
-                    else:
-                        num_before = None
+            if registry is None:
+                messages.append(
+                    "⚠️ Nessun ACTIVE_REGISTRY trovato in core.agents_base; "
+                    "non posso ricaricare gli agent a runtime."
+                )
+            else:
+                # conteggio prima
+                if list_agents is not None:
+                    num_before = len(list_agents())
 
+                # solo il caricamento dei moduli è "non fidato"
+                try:
                     agent_loader.load_agents_from_packages(registry, packages)
                     runtime_reloaded = True
+                except ImportError as exc:
+                    messages.append(f"❌ Errore di import durante il runtime reload: {exc}")
+                except Exception as exc:  # noqa: BLE001
+                    messages.append(f"❌ Errore durante il runtime reload: {exc}")
 
-                    if hasattr(registry, "list_agents"):
-                        num_after = len(registry.list_agents())
-                    else:
-                        num_after = None
+                if runtime_reloaded:
+                    if list_agents is not None:
+                        num_after = len(list_agents())
 
                     if num_before is not None and num_after is not None:
                         messages.append(
@@ -101,9 +109,6 @@ class AgentReloadAgent(Agent):
                             "(numero agent prima/dopo non disponibile)."
                         )
 
-            except Exception as exc:  # noqa: BLE001
-                messages.append(f"❌ Errore durante il runtime reload: {exc}")
-
         elif mode == "runtime" and dry_run:
             messages.append(
                 f"Modalità dry_run: simulerei un runtime reload per i package {packages}, "
@@ -117,22 +122,39 @@ class AgentReloadAgent(Agent):
             # Scriviamo una memoria procedurale che segnala la necessità di reload
             note = {
                 "mode": mode,
-                "packages": packages,
+                "packages": list(packages),
                 "runtime_reloaded": runtime_reloaded,
                 "dry_run": dry_run,
             }
             try:
-                memory.store_item(
+                # idempotenza: se l'ultima richiesta registrata è identica non riscriviamo
+                last = memory.find_items_by_key(
+                    key=PENDING_RELOAD_KEY,
                     scope=MemoryScope.GLOBAL,
                     type_=MemoryType.PROCEDURAL,
-                    key="pending_agent_reload",
-                    content="Agent reload richiesto; effettuare reload all'avvio.",
-                    metadata=note,
-                )
-                messages.append(
-                    "ℹ️ Ho registrato in memoria una richiesta di reload agent "
-                    "(pending_agent_reload) per il prossimo avvio."
+                    limit=1,
                 )
+                if (
+                    last
+                    and last[0].content == PENDING_RELOAD_CONTENT
+                    and last[0].metadata == note
+                ):
+                    messages.append(
+                        "ℹ️ Una richiesta di reload agent identica (pending_agent_reload) "
+                        "è già pianificata per il prossimo avvio."
+                    )
+                else:
+                    memory.store_item(
+                        scope=MemoryScope.GLOBAL,
+                        type_=MemoryType.PROCEDURAL,
+                        key=PENDING_RELOAD_KEY,
+                        content=PENDING_RELOAD_CONTENT,
+                        metadata=note,
+                    )
+                    messages.append(
+                        "ℹ️ Ho registrato in memoria una richiesta di reload agent "
+                        "(pending_agent_reload) per il prossimo avvio."
+                    )
             except Exception as exc:  # noqa: BLE001
                 messages.append(
                     f"⚠️ Non sono riuscito a scrivere la richiesta di reload in memoria: {exc}"
@@ -141,10 +163,7 @@ class AgentReloadAgent(Agent):
         # ----------------------------------------------------------
         # 3) Messaggio finale per l'utente
         # ----------------------------------------------------------
-        header = "🔄 AgentReloadAgent"
-        lines = [header, ""]
-        lines.extend(messages)
-        user_msg = "\n".join(lines)
+        user_msg = "\n".join(messages)
 
         output = {
             "user_visible_message": user_msg,
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+try:  # orjson è opzionale: parsing in C, molto più veloce del json stdlib
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
 
 from core.agents_base import Agent, AgentResult
 from core.models import (
@@ -13,6 +17,105 @@ from core.models import (
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+from core.sheet_cache import cached_load_many
+
+
+# ---------------------------------------------------------
+# Passi statici del piano (tutto tranne le intestazioni che
+# dipendono da obiettivo/target): costruiti una volta sola.
+# ---------------------------------------------------------
+
+STEPS_REGRESSION_TAIL = (
+    "3. Pulizia dati e feature engineering (scaling, trasformazioni, interazioni, gestione outlier).",
+    "4. Train/test split o cross-validation, in funzione della dimensione del dataset e dei vincoli temporali.",
+    "5. Addestramento di modelli di regressione (lineare, elastic net, modelli ad alberi/gradient boosting).",
+    "6. Valutazione con RMSE, MAE, R² e confronto tra modelli.",
+    "7. Analisi di interpretabilità (coefficenti, feature importance, partial dependence) e sintesi business-friendly.",
+)
+
+STEPS_TS_TAIL = (
+    "2. Definizione dell'orizzonte di previsione e della granularità (giornaliera, settimanale, mensile, ecc.).",
+    "3. Creazione di variabili lag, rolling statistics, indicatori di calendario e eventuali covariate esterne.",
+    "4. Split temporale train/validation/test, rispettando l'ordine cronologico.",
+    "5. Addestramento di modelli ARIMA/ETS/Prophet o modelli ML con feature temporali.",
+    "6. Valutazione su finestre temporali con MAPE, sMAPE, RMSE e confronto tra approcci.",
+    "7. Analisi dei residui, diagnostica del modello e definizione di una strategia di aggiornamento periodico.",
+)
+
+STEPS_EXP_TAIL = (
+    "2. Analisi strutturale del dataset: dimensioni, tipi di variabili, percentuale di NA.",
+    "3. Esplorazione univariata e bivariata delle variabili chiave (distribuzioni, boxplot, correlazioni).",
+    "4. Identificazione di pattern, segmenti interessanti e possibili anomalie.",
+    "5. Se utile, applicazione di tecniche di riduzione di dimensionalità o clustering esplorativo.",
+    "6. Sintesi visuale (grafici, tabelle) e definizione di ipotesi/idee per eventuale modellazione successiva.",
+)
+
+STEPS_CLF_TAIL = (
+    "3. Feature engineering specifica (es. recency/frequency/importi per clienti, variabili di comportamento, canali).",
+    "4. Train/test split (holdout o coorte temporale) con attenzione a bilanciamento e leakage.",
+    "5. Addestramento di uno o più modelli di classificazione (logistica, random forest, gradient boosting, ecc.).",
+    "6. Valutazione con AUC, precision/recall, confusion matrix, curve di lift/gain.",
+    "7. Analisi di interpretabilità (feature importance, partial dependence, SHAP) e raccomandazioni operative.",
+)
+
+# Pipeline consigliata: EDA in R → (modeling) → ExplanationAgent
+REC_MODELING = ("r_eda_agent", "r_analysis_agent", "explanation_agent")
+REC_DEFAULT = ("r_eda_agent", "explanation_agent")
+
+# problem_type -> (intestazioni da formattare, passi statici, agent consigliati).
+# Le intestazioni usano i segnaposto {goal_txt} / {tgt_txt}.
+PLAN_TABLE: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]] = {
+    "regression": (
+        (
+            "1. Esplorazione iniziale del dataset{goal_txt}: dimensioni, percentuale di valori mancanti, distribuzioni delle principali variabili.",
+            "2. Definizione chiara della variabile target continua{tgt_txt} e delle feature candidate.",
+        ),
+        STEPS_REGRESSION_TAIL,
+        REC_MODELING,
+    ),
+    "time-series": (
+        (
+            "1. Analisi preliminare della serie temporale{goal_txt}: trend, stagionalità, outlier e cambi di regime.",
+        ),
+        STEPS_TS_TAIL,
+        REC_DEFAULT,
+    ),
+    "exploratory": (
+        (
+            "1. Comprensione del contesto e degli obiettivi esplorativi{goal_txt} (quali domande vogliamo davvero porre ai dati).",
+        ),
+        STEPS_EXP_TAIL,
+        REC_DEFAULT,
+    ),
+    # classification (default, compatibile con churn)
+    "classification": (
+        (
+            "1. Esplorazione iniziale del dataset{goal_txt}: dimensioni, qualità dei dati, distribuzioni di feature e target.",
+            "2. Definizione chiara della variabile target e della finestra temporale{tgt_txt}.",
+        ),
+        STEPS_CLF_TAIL,
+        REC_MODELING,
+    ),
+}
+
+# Piani completi senza obiettivo/target, precalcolati per il caso più comune
+CANONICAL_STEPS: Dict[str, Tuple[str, ...]] = {
+    problem_type: (*(h.format(goal_txt="", tgt_txt="") for h in heads), *tail)
+    for problem_type, (heads, tail, _) in PLAN_TABLE.items()
+}
+
+# problem_type le cui intestazioni mostrano il target (le altre lo ignorano)
+HEADS_WITH_TARGET = frozenset(
+    problem_type
+    for problem_type, (heads, _, _) in PLAN_TABLE.items()
+    if any("{tgt_txt}" in h for h in heads)
+)
+
+# Se True, plan_struct contiene anche 'steps' (alias legacy di 'analysis_steps')
+EMIT_LEGACY_STEPS_ALIAS = False
+
+VALID_PROBLEM_TYPES = frozenset({"classification", "regression", "time-series"})
+EXPLORATORY_ALIASES = frozenset({"clustering", "exploratory", "other"})
 
 
 class AnalysisPlannerAgent(Agent):
@@ -35,35 +138,33 @@ class AnalysisPlannerAgent(Agent):
         Prova a caricare la requirements_sheet salvata dal RequirementsAgent
         a livello di conversazione e, se presente, a livello di progetto.
         """
-        # 1) Scope CONVERSATION
+        # Scope CONVERSATION, poi PROJECT (se abbiamo un project_id):
+        # una sola lettura batch, vince il primo contenuto valido
+        lookups: List[Tuple[MemoryScope, str]] = []
+
         conv_id = getattr(context, "id", None)
         if conv_id:
-            key_conv = f"requirements_sheet:{conv_id}"
-            try:
-                raw = memory.load_item_content(
-                    key=key_conv,
-                    scope=MemoryScope.CONVERSATION,
-                    type_=MemoryType.PROCEDURAL,
-                )
-                if raw:
-                    return json.loads(raw)
-            except Exception:
-                pass
+            lookups.append((MemoryScope.CONVERSATION, f"requirements_sheet:{conv_id}"))
 
-        # 2) Scope PROJECT (se abbiamo un project_id)
         project_id = getattr(context, "project_id", None) or getattr(
             context, "current_project_id", None
         )
         if project_id:
-            key_proj = f"requirements_sheet:{project_id}"
+            lookups.append((MemoryScope.PROJECT, f"requirements_sheet:{project_id}"))
+
+        if not lookups:
+            return None
+
+        try:
+            raws = cached_load_many(memory, lookups)
+        except Exception:
+            return None
+
+        for raw in raws:
+            if not raw:
+                continue
             try:
-                raw = memory.load_item_content(
-                    key=key_proj,
-                    scope=MemoryScope.PROJECT,
-                    type_=MemoryType.PROCEDURAL,
-                )
-                if raw:
-                    return json.loads(raw)
+                return _json_loads(raw)
             except Exception:
                 pass
 
@@ -92,9 +193,9 @@ class AnalysisPlannerAgent(Agent):
             source = "requirements_sheet"
 
         # normalizziamo
-        if problem_type not in {"classification", "regression", "time-series"}:
+        if problem_type not in VALID_PROBLEM_TYPES:
             # se la scheda parla di clustering/exploratory/other → trattiamo come exploratory
-            if problem_type in {"clustering", "exploratory", "other"}:
+            if problem_type in EXPLORATORY_ALIASES:
                 problem_type = "exploratory"
             else:
                 # default se non specificato
@@ -122,64 +223,22 @@ class AnalysisPlannerAgent(Agent):
         # 4) Costruiamo i passi del piano in base al tipo di problema
         steps: List[str]
 
-        # Testo extra da inserire nei punti 1–2 se abbiamo info
-        goal_txt = f" (obiettivo: {primary_goal})" if primary_goal else ""
-        tgt_txt = (
-            f" (target: {target_variable})" if target_variable else ""
-        )
-
-        if problem_type == "regression":
+        heads, tail, rec_agents = PLAN_TABLE[problem_type]
+        use_tgt = bool(target_variable) and problem_type in HEADS_WITH_TARGET
+        if primary_goal or use_tgt:
+            # Testo extra da inserire nei punti 1–2, formattato solo se serve
+            goal_txt = f" (obiettivo: {primary_goal})" if primary_goal else ""
+            tgt_txt = f" (target: {target_variable})" if use_tgt else ""
             steps = [
-                f"1. Esplorazione iniziale del dataset{goal_txt}: dimensioni, percentuale di valori mancanti, distribuzioni delle principali variabili.",
-                f"2. Definizione chiara della variabile target continua{tgt_txt} e delle feature candidate.",
-                "3. Pulizia dati e feature engineering (scaling, trasformazioni, interazioni, gestione outlier).",
-                "4. Train/test split o cross-validation, in funzione della dimensione del dataset e dei vincoli temporali.",
-                "5. Addestramento di modelli di regressione (lineare, elastic net, modelli ad alberi/gradient boosting).",
-                "6. Valutazione con RMSE, MAE, R² e confronto tra modelli.",
-                "7. Analisi di interpretabilità (coefficenti, feature importance, partial dependence) e sintesi business-friendly.",
-            ]
-        elif problem_type == "time-series":
-            steps = [
-                f"1. Analisi preliminare della serie temporale{goal_txt}: trend, stagionalità, outlier e cambi di regime.",
-                "2. Definizione dell'orizzonte di previsione e della granularità (giornaliera, settimanale, mensile, ecc.).",
-                "3. Creazione di variabili lag, rolling statistics, indicatori di calendario e eventuali covariate esterne.",
-                "4. Split temporale train/validation/test, rispettando l'ordine cronologico.",
-                "5. Addestramento di modelli ARIMA/ETS/Prophet o modelli ML con feature temporali.",
-                "6. Valutazione su finestre temporali con MAPE, sMAPE, RMSE e confronto tra approcci.",
-                "7. Analisi dei residui, diagnostica del modello e definizione di una strategia di aggiornamento periodico.",
-            ]
-        elif problem_type == "exploratory":
-            steps = [
-                f"1. Comprensione del contesto e degli obiettivi esplorativi{goal_txt} (quali domande vogliamo davvero porre ai dati).",
-                "2. Analisi strutturale del dataset: dimensioni, tipi di variabili, percentuale di NA.",
-                "3. Esplorazione univariata e bivariata delle variabili chiave (distribuzioni, boxplot, correlazioni).",
-                "4. Identificazione di pattern, segmenti interessanti e possibili anomalie.",
-                "5. Se utile, applicazione di tecniche di riduzione di dimensionalità o clustering esplorativo.",
-                "6. Sintesi visuale (grafici, tabelle) e definizione di ipotesi/idee per eventuale modellazione successiva.",
-            ]
-        else:  # classification (default, compatibile con churn)
-            steps = [
-                f"1. Esplorazione iniziale del dataset{goal_txt}: dimensioni, qualità dei dati, distribuzioni di feature e target.",
-                f"2. Definizione chiara della variabile target e della finestra temporale{tgt_txt}.",
-                "3. Feature engineering specifica (es. recency/frequency/importi per clienti, variabili di comportamento, canali).",
-                "4. Train/test split (holdout o coorte temporale) con attenzione a bilanciamento e leakage.",
-                "5. Addestramento di uno o più modelli di classificazione (logistica, random forest, gradient boosting, ecc.).",
-                "6. Valutazione con AUC, precision/recall, confusion matrix, curve di lift/gain.",
-                "7. Analisi di interpretabilità (feature importance, partial dependence, SHAP) e raccomandazioni operative.",
+                *(h.format(goal_txt=goal_txt, tgt_txt=tgt_txt) for h in heads),
+                *tail,
             ]
+        else:
+            # caso più comune (nessun obiettivo/target): piano già pronto
+            steps = list(CANONICAL_STEPS[problem_type])
 
         # 4.b) Recommended agents per pipeline: EDA → Modeling → Explainability
-        recommended_agents: List[str] = []
-
-        # Sempre EDA in R come primo passo
-        recommended_agents.append("r_eda_agent")
-
-        # Per classification/regression usiamo r_analysis_agent come demo/modeling
-        if problem_type in {"classification", "regression"}:
-            recommended_agents.append("r_analysis_agent")
-
-        # Chiudiamo con ExplanationAgent per la parte narrativa
-        recommended_agents.append("explanation_agent")
+        recommended_agents = list(rec_agents)
 
         # 5) Costruiamo un oggetto piano strutturato da salvare in memoria
         plan_struct: Dict[str, Any] = {
@@ -195,20 +254,23 @@ class AnalysisPlannerAgent(Agent):
             "data_type": data_type,
             # nuovo: alias esplicito, utile per Explanation / altri agent
             "analysis_steps": steps,
-            # manteniamo anche il campo originale 'steps' per retrocompatibilità
-            "steps": steps,
             # nuovo: pipeline consigliata di agent da chiamare
             "recommended_agents": recommended_agents,
         }
+        # il campo originale 'steps' duplica analysis_steps in ogni serializzazione:
+        # lo emettiamo solo se qualche consumer legacy lo richiede ancora
+        if EMIT_LEGACY_STEPS_ALIAS:
+            plan_struct["steps"] = steps
 
-        # 6) Salviamo in memoria
+        # 6) Salviamo in memoria la versione strutturata (JSON): gli agent a valle
+        #    la rileggono con json.loads invece di ri-parsare testo
         try:
             memory.store_item(
                 scope=MemoryScope.CONVERSATION,
                 type_=MemoryType.PROCEDURAL,
-                key="analysis_plan_text",
-                content="\n".join(steps),
-                metadata={"agent": self.name},
+                key="analysis_plan_structured",
+                content=plan_struct,
+                metadata={"agent": self.name, "format": "json"},
             )
         except Exception:
             pass
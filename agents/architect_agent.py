@@ -1,27 +1,68 @@
 # agents/architect_agent.py
 from __future__ import annotations
 
-import json
-from dataclasses import asdict, dataclass, field
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Literal
+import re
+from typing import Any, Dict, List, Optional, Literal, Tuple
 
 from core.agents_base import Agent, AgentResult
 from core.models import (
     EmotionalState,
     EmotionDelta,
     ConversationContext,
+    Message,
+    MessageRole,
     new_id,
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+from core.llm_cache import LLMResponseCache
+from core.json_utils import json_dumps, json_loads
 
 
 AgentType = Literal["python", "r"]
 LifecycleState = Literal["draft", "test", "active", "deprecated"]
 
+VALID_AGENT_TYPES = frozenset({"python", "r"})
+LIFECYCLE_STATES = frozenset({"draft", "test", "active", "deprecated"})
+# stati da cui il Critic può promuovere ad "active"
+PROMOTABLE_STATES = frozenset({"test", "active"})
+
+
+# Prompt costanti, costruiti una volta sola all'import
+ARCHITECT_SYSTEM_PROMPT = (
+    "Sei un Architect per un sistema multi-agent. "
+    "Devi definire un NUOVO agent a partire dalla richiesta utente.\n\n"
+    "Rispondi SOLO con un JSON valido con lo schema minimo:\n"
+    "{\n"
+    '  "name": "nome_snake_case",\n'
+    '  "description": "testo descrittivo",\n'
+    '  "type": "python" o "r",\n'
+    '  "module": "per_agent_python.esempio" (se type=python),\n'
+    '  "class_name": "NomeClasseAgent" (se type=python),\n'
+    '  "r_script_path": "r_agents/esempio.R" (se type=r),\n'
+    '  "system_prompt_template": "istruzioni per l\'agent",\n'
+    '  "tools": [\n'
+    "    {\"name\": \"tool_name\", \"description\": \"...\", \"params_schema\": {\"param\": \"type\"}}\n"
+    "  ],\n"
+    '  "default_parameters": { ... },\n'
+    '  "tags": ["tag1", "tag2"],\n'
+    '  "notes": "note opzionali"\n'
+    "}\n"
+    "Non aggiungere testo fuori dal JSON."
+)
+
+# system_prompt_template usato quando l'LLM non è disponibile
+FALLBACK_AGENT_PROMPT = (
+    "Sei un agent monofunzionale nel sistema cognitive_os. "
+    "Segui rigorosamente lo scopo per cui sei stato creato. "
+    "Non fare routing, non creare altri agent. "
+    "Rispondi nel modo più chiaro e strutturato possibile."
+)
+
 
-@dataclass
+@dataclass(slots=True)
 class ToolConfig:
     """
     Descrizione logica di un tool che l'agent potrà usare.
@@ -33,7 +74,7 @@ class ToolConfig:
     params_schema: Dict[str, Any] = field(default_factory=dict)
 
 
-@dataclass
+@dataclass(slots=True)
 class AgentConfig:
     """
     Config JSON che finisce dentro agent_definitions.config.
@@ -63,14 +104,256 @@ class AgentConfig:
     tags: List[str] = field(default_factory=list)
     notes: str = ""
 
+    def to_json_dict(self) -> Dict[str, Any]:
+        """
+        Dict piatto per agent_definitions.config (equivalente ad asdict, ma
+        senza deepcopy ricorsivo: i campi sono già tipi JSON nativi).
+        """
+        return {
+            "type": self.type,
+            "module": self.module,
+            "class_name": self.class_name,
+            "r_script_path": self.r_script_path,
+            "system_prompt_template": self.system_prompt_template,
+            "tools": list(self.tools),
+            "default_parameters": dict(self.default_parameters),
+            "tags": list(self.tags),
+            "notes": self.notes,
+        }
+
+
+@dataclass(slots=True)
+class ValidatorParams:
+    """
+    Parametri di input del ValidatorAgent (vedi docstring della classe).
+    """
+
+    min_description_len: int = 20
+    require_prompt: bool = True
+    auto_promote_to_test: bool = False
+
+    @classmethod
+    def from_payload(cls, input_payload: Dict[str, Any]) -> "ValidatorParams":
+        return cls(
+            min_description_len=int(input_payload.get("min_description_len", 20)),
+            require_prompt=bool(input_payload.get("require_prompt", True)),
+            auto_promote_to_test=bool(input_payload.get("auto_promote_to_test", False)),
+        )
+
+
+@dataclass(slots=True)
+class CriticParams:
+    """
+    Parametri di input del CriticAgent (vedi docstring della classe).
+    """
+
+    promote_to_active: bool = False
+    force_state: Optional[str] = None
+
+    @classmethod
+    def from_payload(cls, input_payload: Dict[str, Any]) -> "CriticParams":
+        return cls(
+            promote_to_active=bool(input_payload.get("promote_to_active", False)),
+            force_state=input_payload.get("force_state"),
+        )
+
+
+# Normalizzazione nomi: whitespace → "_" in un solo passaggio
+_NAME_TRANS = str.maketrans({c: "_" for c in " \t\n\r"})
+_SNAKE_NAME_RE = re.compile(r"^[a-z][a-z0-9_]*$")
+
+
+def _snake(s: str) -> str:
+    return s.strip().translate(_NAME_TRANS).lower()
+
 
 def _safe_json_loads(raw: str) -> Optional[Dict[str, Any]]:
     try:
-        return json.loads(raw)
+        return json_loads(raw)
     except Exception:  # noqa: BLE001
         return None
 
 
+# ----------------------------------------------------------------------
+# Schema della config prodotta dall'LLM (validatore compilato una volta)
+# ----------------------------------------------------------------------
+_NULLABLE_STR = {"type": ["string", "null"]}
+
+AGENT_CONFIG_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "name": _NULLABLE_STR,
+        "description": _NULLABLE_STR,
+        "type": {"enum": ["python", "r"]},
+        "module": _NULLABLE_STR,
+        "class_name": _NULLABLE_STR,
+        "r_script_path": _NULLABLE_STR,
+        "system_prompt_template": _NULLABLE_STR,
+        "tools": {"type": ["array", "null"], "items": {"type": "object"}},
+        "default_parameters": {"type": ["object", "null"]},
+        "tags": {"type": ["array", "null"], "items": {"type": "string"}},
+        "notes": _NULLABLE_STR,
+    },
+}
+
+_JSON_TYPES: Dict[str, Any] = {
+    "string": str,
+    "object": dict,
+    "array": list,
+    "null": type(None),
+}
+
+
+def _compile_fallback_validator(schema: Dict[str, Any]):
+    """
+    Validatore minimale (solo type/enum/items) per quando fastjsonschema
+    non è installato. Come fastjsonschema, solleva ValueError se non valido.
+    """
+    properties = schema.get("properties", {})
+
+    def _check(value: Any, spec: Dict[str, Any], path: str) -> None:
+        if "enum" in spec and value not in spec["enum"]:
+            raise ValueError(f"{path} must be one of {spec['enum']}")
+        if "type" in spec:
+            allowed = spec["type"] if isinstance(spec["type"], list) else [spec["type"]]
+            if not isinstance(value, tuple(_JSON_TYPES[t] for t in allowed)):
+                raise ValueError(f"{path} must be {' or '.join(allowed)}")
+        if "items" in spec and isinstance(value, list):
+            for i, item in enumerate(value):
+                _check(item, spec["items"], f"{path}[{i}]")
+
+    def validate(data: Any) -> Any:
+        _check(data, {"type": schema.get("type", "object")}, "data")
+        for key, spec in properties.items():
+            if key in data:
+                _check(data[key], spec, f"data.{key}")
+        return data
+
+    return validate
+
+
+# Una AgentConfig tipica sta in ~200 token: non serve riservarne di più
+ARCHITECT_MAX_TOKENS = 384
+
+# JSON mode dei backend OpenAI-compatibili (Groq/OpenAI): il modello è vincolato
+# a emettere un oggetto JSON; la conformità allo schema resta a validate_agent_config
+ARCHITECT_RESPONSE_FORMAT: Dict[str, Any] = {"type": "json_object"}
+
+
+try:  # fastjsonschema è opzionale: genera codice Python specializzato per lo schema
+    import fastjsonschema
+
+    validate_agent_config = fastjsonschema.compile(AGENT_CONFIG_SCHEMA)
+except ImportError:
+    validate_agent_config = _compile_fallback_validator(AGENT_CONFIG_SCHEMA)
+
+
+def _parse_llm_config(raw: str) -> Optional[Dict[str, Any]]:
+    """
+    JSON dell'LLM → dict, solo se rispetta AGENT_CONFIG_SCHEMA; altrimenti None
+    (e l'Architect usa il fallback deterministico).
+    """
+    parsed = _safe_json_loads(raw)
+    if not isinstance(parsed, dict):
+        return None
+    try:
+        validate_agent_config(parsed)
+    except ValueError:  # fastjsonschema.JsonSchemaException è una ValueError
+        return None
+    return parsed
+
+
+def _fallback_config(name: str, preferred_type: AgentType) -> AgentConfig:
+    """
+    AgentConfig deterministica usata dall'Architect quando l'LLM non è
+    disponibile o non produce un JSON valido.
+    """
+    if preferred_type == "python":
+        return AgentConfig(
+            type="python",
+            module=f"agents.{name}",
+            class_name="".join(part.capitalize() for part in name.split("_")),
+            system_prompt_template=FALLBACK_AGENT_PROMPT,
+            tags=["auto_generated"],
+            notes="Definizione generata senza LLM (fallback).",
+        )
+    return AgentConfig(
+        type=preferred_type,
+        r_script_path=f"r_agents/{name}.R",
+        system_prompt_template=FALLBACK_AGENT_PROMPT,
+        tags=["auto_generated"],
+        notes="Definizione generata senza LLM (fallback).",
+    )
+
+
+def check_agent_definition(
+    name: Optional[str],
+    description: Optional[str],
+    cfg_dict: Dict[str, Any],
+    min_description_len: int = 20,
+    require_prompt: bool = True,
+) -> List[str]:
+    """
+    Controlli deterministici del ValidatorAgent su una AgentDefinition.
+    Ritorna la lista dei problemi trovati (vuota se valida).
+    """
+    issues: List[str] = []
+    cfg_type = cfg_dict.get("type", "python")
+
+    # 1) Tipo valido
+    if cfg_type not in VALID_AGENT_TYPES:
+        issues.append(f"type non valido: {cfg_type!r}")
+
+    # 2) Binding per tipo
+    if cfg_type == "python":
+        if not cfg_dict.get("module") or not cfg_dict.get("class_name"):
+            issues.append("Per type='python' servono module e class_name non vuoti.")
+    else:
+        if not cfg_dict.get("r_script_path"):
+            issues.append("Per type='r' serve r_script_path non vuoto.")
+
+    # 3) Descrizione minima
+    desc = (description or "").strip()
+    if len(desc) < min_description_len:
+        issues.append(
+            f"Descrizione troppo corta (len={len(desc)}, minimo richiesto={min_description_len})."
+        )
+
+    # 4) Prompt di sistema minimo
+    prompt_template = cfg_dict.get("system_prompt_template") or ""
+    if require_prompt and len(prompt_template.strip()) < 10:
+        issues.append("system_prompt_template troppo corto o mancante.")
+
+    # 5) Nome
+    if not name or not _SNAKE_NAME_RE.match(name):
+        issues.append("name mancante o non in snake_case (es. mio_agent).")
+
+    return issues
+
+
+def _load_candidate(
+    memory: MemoryEngine,
+    target_id: Optional[str],
+) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Carica la AgentDefinition su cui lavorano Validator/Critic:
+    quella con id `target_id` (lookup per primary key) oppure l'ultima creata.
+    Ritorna (candidate, has_defs); has_defs=False se non esiste nessuna definizione.
+    """
+    if target_id and hasattr(memory, "get_agent_definition"):
+        return memory.get_agent_definition(target_id), True
+    if not target_id and hasattr(memory, "get_latest_agent_definition"):
+        latest = memory.get_latest_agent_definition()
+        return latest, latest is not None
+
+    defs = memory.list_agent_definitions()
+    if not defs:
+        return None, False
+    if target_id:
+        return next((d for d in defs if d["id"] == target_id), None), True
+    return defs[-1], True  # ultima definizione
+
+
 # ----------------------------------------------------------------------
 # 1) ARCHITECT
 # ----------------------------------------------------------------------
@@ -99,7 +382,7 @@ class ArchitectAgent(Agent):
     ) -> AgentResult:
         user_request = input_payload.get("user_request", "").strip()
         preferred_type: AgentType = input_payload.get("preferred_type", "python")  # type: ignore[assignment]
-        if preferred_type not in ("python", "r"):
+        if preferred_type not in VALID_AGENT_TYPES:
             preferred_type = "python"
 
         suggested_name = input_payload.get("suggested_name")
@@ -112,37 +395,23 @@ class ArchitectAgent(Agent):
         short_id = agent_id.split("-")[0]
 
         if suggested_name:
-            base_name = suggested_name.strip().lower().replace(" ", "_")
+            base_name = _snake(suggested_name)
         else:
             base_name = f"custom_agent_{short_id}"
 
         # ------------------------------------------------------------------
-        # 2) Proviamo a farci aiutare dall'LLM per una config ricca
+        # 2) Ramo di fallback deterministico, pronto (e già validato) prima
+        #    della chiamata LLM: se l'LLM fallisce lo riusiamo così com'è
         # ------------------------------------------------------------------
-        system_prompt = (
-            "Sei un Architect per un sistema multi-agent. "
-            "Devi definire un NUOVO agent a partire dalla richiesta utente.\n\n"
-            "Rispondi SOLO con un JSON valido con lo schema minimo:\n"
-            "{\n"
-            '  "name": "nome_snake_case",\n'
-            '  "description": "testo descrittivo",\n'
-            '  "type": "python" o "r",\n'
-            '  "module": "per_agent_python.esempio" (se type=python),\n'
-            '  "class_name": "NomeClasseAgent" (se type=python),\n'
-            '  "r_script_path": "r_agents/esempio.R" (se type=r),\n'
-            '  "system_prompt_template": "istruzioni per l\'agent",\n'
-            '  "tools": [\n'
-            "    {\"name\": \"tool_name\", \"description\": \"...\", \"params_schema\": {\"param\": \"type\"}}\n"
-            "  ],\n"
-            '  "default_parameters": { ... },\n'
-            '  "tags": ["tag1", "tag2"],\n'
-            '  "notes": "note opzionali"\n'
-            "}\n"
-            "Non aggiungere testo fuori dal JSON."
+        fallback_cfg = _fallback_config(base_name, preferred_type)
+        fallback_description = user_request or f"Agent generato automaticamente ({preferred_type})."
+        fallback_issues = check_agent_definition(
+            base_name, fallback_description, fallback_cfg.to_json_dict()
         )
 
-        from core.models import Message, MessageRole  # type: ignore
-
+        # ------------------------------------------------------------------
+        # 3) Proviamo a farci aiutare dall'LLM per una config ricca
+        # ------------------------------------------------------------------
         llm_input = {
             "user_request": user_request,
             "preferred_type": preferred_type,
@@ -150,23 +419,31 @@ class ArchitectAgent(Agent):
         }
 
         llm_messages = [
-            Message(role=MessageRole.USER, content=json.dumps(llm_input, ensure_ascii=False))
+            Message(role=MessageRole.USER, content=json_dumps(llm_input))
         ]
 
         raw = ""
         llm_config: Optional[Dict[str, Any]] = None
         try:
-            raw = llm.generate(system_prompt=system_prompt, messages=llm_messages, max_tokens=1024)
-            llm_config = _safe_json_loads(raw)
+            # richieste identiche riusano la config già generata (niente chiamata LLM)
+            raw = LLMResponseCache(memory, namespace="architect_config").generate(
+                llm,
+                system_prompt=ARCHITECT_SYSTEM_PROMPT,
+                messages=llm_messages,
+                should_cache=lambda r: _parse_llm_config(r) is not None,
+                max_tokens=ARCHITECT_MAX_TOKENS,
+                response_format=ARCHITECT_RESPONSE_FORMAT,
+            )
+            llm_config = _parse_llm_config(raw)
         except Exception:  # noqa: BLE001
             llm_config = None
 
         # ------------------------------------------------------------------
-        # 3) Costruiamo l'AgentConfig a partire da LLM o fallback deterministico
+        # 4) Costruiamo l'AgentConfig a partire da LLM o fallback deterministico
         # ------------------------------------------------------------------
         if llm_config and isinstance(llm_config, dict):
             name_from_llm = llm_config.get("name") or base_name
-            name = str(name_from_llm).strip().lower().replace(" ", "_")
+            name = _snake(str(name_from_llm))
 
             cfg = AgentConfig(
                 type=llm_config.get("type", preferred_type),
@@ -183,41 +460,23 @@ class ArchitectAgent(Agent):
         else:
             # Fallback completamente deterministico, senza dipendere dall'LLM
             name = base_name
-            if preferred_type == "python":
-                module = f"agents.{name}"
-                class_name = "".join(part.capitalize() for part in name.split("_"))
-                r_script_path = None
-            else:
-                module = None
-                class_name = None
-                r_script_path = f"r_agents/{name}.R"
-
-            cfg = AgentConfig(
-                type=preferred_type,
-                module=module,
-                class_name=class_name,
-                r_script_path=r_script_path,
-                system_prompt_template=(
-                    "Sei un agent monofunzionale nel sistema cognitive_os. "
-                    "Segui rigorosamente lo scopo per cui sei stato creato. "
-                    "Non fare routing, non creare altri agent. "
-                    "Rispondi nel modo più chiaro e strutturato possibile."
-                ),
-                tools=[],
-                default_parameters={},
-                tags=["auto_generated"],
-                notes="Definizione generata senza LLM (fallback).",
-            )
-            description = user_request or f"Agent generato automaticamente ({preferred_type})."
+            cfg = fallback_cfg
+            description = fallback_description
 
         # ------------------------------------------------------------------
-        # 4) Costruiamo la AgentDefinition logica (dict) + salvataggio
+        # 5) Costruiamo la AgentDefinition logica (dict) + salvataggio
         # ------------------------------------------------------------------
+        cfg_dict = cfg.to_json_dict()
+        if cfg is fallback_cfg:
+            validation_issues = fallback_issues
+        else:
+            validation_issues = check_agent_definition(name, description, cfg_dict)
+
         definition: Dict[str, Any] = {
             "id": agent_id,
             "name": name,
             "description": description,
-            "config": asdict(cfg),
+            "config": cfg_dict,
             "is_active": False,  # sempre bozza iniziale
             "parent_id": parent_id,
             "lifecycle_state": "draft",
@@ -233,29 +492,32 @@ class ArchitectAgent(Agent):
             definition["save_error"] = str(exc)
 
         # ------------------------------------------------------------------
-        # 5) Output user-visible
+        # 6) Output user-visible
         # ------------------------------------------------------------------
-        msg_lines = [
-            "Ho creato una nuova AgentDefinition in stato 'draft'.",
-            f"- id: {agent_id}",
-            f"- name: {name}",
-            f"- type: {cfg.type}",
-        ]
         if cfg.type == "python":
-            msg_lines.append(f"- module: {cfg.module}")
-            msg_lines.append(f"- class_name: {cfg.class_name}")
+            binding = f"- module: {cfg.module}\n- class_name: {cfg.class_name}"
         else:
-            msg_lines.append(f"- r_script_path: {cfg.r_script_path}")
-
-        if not saved_ok:
-            msg_lines.append("\n⚠️ Attenzione: si è verificato un errore nel salvataggio su memoria.")
+            binding = f"- r_script_path: {cfg.r_script_path}"
+        save_warning = (
+            ""
+            if saved_ok
+            else "\n\n⚠️ Attenzione: si è verificato un errore nel salvataggio su memoria."
+        )
 
-        user_message = "\n".join(msg_lines)
+        user_message = (
+            "Ho creato una nuova AgentDefinition in stato 'draft'.\n"
+            f"- id: {agent_id}\n"
+            f"- name: {name}\n"
+            f"- type: {cfg.type}\n"
+            f"{binding}{save_warning}"
+        )
 
         output = {
             "user_visible_message": user_message,
             "stop_for_user_input": False,
             "agent_definition": definition,
+            # pre-validazione con i parametri di default del Validator
+            "validation_issues": validation_issues,
         }
 
         delta = EmotionDelta(curiosity=0.04, confidence=0.03)
@@ -297,8 +559,9 @@ class ValidatorAgent(Agent):
                 emotion_delta=EmotionDelta(),
             )
 
-        defs = memory.list_agent_definitions()
-        if not defs:
+        target_id = input_payload.get("target_id")
+        candidate, has_defs = _load_candidate(memory, target_id)
+        if not has_defs:
             return AgentResult(
                 output_payload={
                     "user_visible_message": "Validator: nessuna AgentDefinition trovata.",
@@ -307,16 +570,6 @@ class ValidatorAgent(Agent):
                 emotion_delta=EmotionDelta(),
             )
 
-        target_id = input_payload.get("target_id")
-        candidate: Optional[Dict[str, Any]] = None
-        if target_id:
-            for d in defs:
-                if d["id"] == target_id:
-                    candidate = d
-                    break
-        else:
-            candidate = defs[-1]  # ultima definizione
-
         if candidate is None:
             return AgentResult(
                 output_payload={
@@ -327,52 +580,23 @@ class ValidatorAgent(Agent):
             )
 
         # Parametri di validazione
-        min_description_len = int(input_payload.get("min_description_len", 20))
-        require_prompt = bool(input_payload.get("require_prompt", True))
-        auto_promote = bool(input_payload.get("auto_promote_to_test", False))
+        params = ValidatorParams.from_payload(input_payload)
+        min_description_len = params.min_description_len
+        require_prompt = params.require_prompt
+        auto_promote = params.auto_promote_to_test
 
+        # Leggiamo direttamente dal dict salvato: niente AgentConfig/to_json_dict intermedi
         cfg_dict = candidate.get("config", {}) or {}
-        cfg = AgentConfig(
-            type=cfg_dict.get("type", "python"),
-            module=cfg_dict.get("module"),
-            class_name=cfg_dict.get("class_name"),
-            r_script_path=cfg_dict.get("r_script_path"),
-            system_prompt_template=cfg_dict.get("system_prompt_template", ""),
-            tools=cfg_dict.get("tools", []) or [],
-            default_parameters=cfg_dict.get("default_parameters", {}) or {},
-            tags=cfg_dict.get("tags", []) or [],
-            notes=cfg_dict.get("notes", "") or "",
-        )
-
-        issues: List[str] = []
-
-        # 1) Tipo valido
-        if cfg.type not in ("python", "r"):
-            issues.append(f"type non valido: {cfg.type!r}")
-
-        # 2) Binding per tipo
-        if cfg.type == "python":
-            if not cfg.module or not cfg.class_name:
-                issues.append("Per type='python' servono module e class_name non vuoti.")
-        else:
-            if not cfg.r_script_path:
-                issues.append("Per type='r' serve r_script_path non vuoto.")
-
-        # 3) Descrizione minima
-        desc = (candidate.get("description") or "").strip()
-        if len(desc) < min_description_len:
-            issues.append(
-                f"Descrizione troppo corta (len={len(desc)}, minimo richiesto={min_description_len})."
-            )
-
-        # 4) Prompt di sistema minimo
-        if require_prompt and len(cfg.system_prompt_template.strip()) < 10:
-            issues.append("system_prompt_template troppo corto o mancante.")
-
-        # 5) Nome
+        cfg_type = cfg_dict.get("type", "python")
         name = candidate.get("name", "")
-        if not name or " " in name:
-            issues.append("name mancante o contiene spazi; usa snake_case.")
+
+        issues = check_agent_definition(
+            name,
+            candidate.get("description"),
+            cfg_dict,
+            min_description_len=min_description_len,
+            require_prompt=require_prompt,
+        )
 
         valid = len(issues) == 0
 
@@ -383,7 +607,7 @@ class ValidatorAgent(Agent):
             new_state = "test"
             candidate["lifecycle_state"] = new_state
             candidate["is_active"] = False  # ancora in test
-            candidate["config"] = asdict(cfg)
+            candidate["config"] = cfg_dict
             try:
                 memory.save_agent_definition(candidate)
             except Exception:
@@ -392,19 +616,15 @@ class ValidatorAgent(Agent):
         # Output per l'utente
         lines = [
             f"Validator su AgentDefinition '{name}' (id={candidate['id']})",
-            f"- type: {cfg.type}",
+            f"- type: {cfg_type}",
             f"- stato: {previous_state} → {new_state}",
             "",
+            "✅ Validazione: OK (nessun problema bloccante)."
+            if valid
+            else "❌ Validazione: sono emersi problemi:",
+            *(f"  - {issue}" for issue in issues),
         ]
 
-        if valid:
-            lines.append("✅ Validazione: OK (nessun problema bloccante).")
-        else:
-            lines.append("❌ Validazione: sono emersi problemi:")
-
-        for issue in issues:
-            lines.append(f"  - {issue}")
-
         output = {
             "user_visible_message": "\n".join(lines),
             "stop_for_user_input": False,
@@ -454,8 +674,9 @@ class CriticAgent(Agent):
                 emotion_delta=EmotionDelta(),
             )
 
-        defs = memory.list_agent_definitions()
-        if not defs:
+        target_id = input_payload.get("target_id")
+        candidate, has_defs = _load_candidate(memory, target_id)
+        if not has_defs:
             return AgentResult(
                 output_payload={
                     "user_visible_message": "Critic: nessuna AgentDefinition trovata.",
@@ -464,18 +685,9 @@ class CriticAgent(Agent):
                 emotion_delta=EmotionDelta(),
             )
 
-        target_id = input_payload.get("target_id")
-        promote_to_active = bool(input_payload.get("promote_to_active", False))
-        force_state = input_payload.get("force_state")
-
-        candidate: Optional[Dict[str, Any]] = None
-        if target_id:
-            for d in defs:
-                if d["id"] == target_id:
-                    candidate = d
-                    break
-        else:
-            candidate = defs[-1]
+        params = CriticParams.from_payload(input_payload)
+        promote_to_active = params.promote_to_active
+        force_state = params.force_state
 
         if candidate is None:
             return AgentResult(
@@ -494,11 +706,11 @@ class CriticAgent(Agent):
         new_state = prev_state
         new_active = prev_active
 
-        if force_state in ("draft", "test", "active", "deprecated"):
+        if force_state in LIFECYCLE_STATES:
             new_state = force_state  # override
             new_active = force_state == "active"
         elif promote_to_active:
-            if prev_state not in ("test", "active"):
+            if prev_state not in PROMOTABLE_STATES:
                 # non promuovere da draft direttamente a active (per ora)
                 new_state = "test"
                 new_active = False
@@ -519,20 +731,20 @@ class CriticAgent(Agent):
         else:
             save_error = ""
 
+        if not (promote_to_active or force_state):
+            outcome = "ℹ️ Nessuna promozione richiesta (solo valutazione)."
+        elif save_ok:
+            outcome = "✅ Stato aggiornato e salvato in memoria."
+        else:
+            outcome = f"⚠️ Errore nel salvataggio: {save_error}"
+
         lines = [
             f"Critic su AgentDefinition '{name}' (id={candidate['id']})",
             f"- stato: {prev_state} → {new_state}",
             f"- is_active: {prev_active} → {new_active}",
+            outcome,
         ]
 
-        if promote_to_active or force_state:
-            if save_ok:
-                lines.append("✅ Stato aggiornato e salvato in memoria.")
-            else:
-                lines.append(f"⚠️ Errore nel salvataggio: {save_error}")
-        else:
-            lines.append("ℹ️ Nessuna promozione richiesta (solo valutazione).")
-
         output = {
             "user_visible_message": "\n".join(lines),
             "stop_for_user_input": False,
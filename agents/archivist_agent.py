@@ -1,8 +1,9 @@
 # agents/archivist_agent.py
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
 
 from core.agents_base import Agent, AgentResult
 from core.models import (
@@ -16,6 +17,85 @@ from core.models import (
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+from core.llm_cache import LLMResponseCache
+from core.json_utils import json_dumps
+
+
+ARCHIVIST_SYSTEM_PROMPT = (
+    "Sei l'Archivist interno di un sistema multi-agent. "
+    "Ricevi un elenco di memorie (log di conversazione, note, risultati di agent). "
+    "Devi scrivere un riassunto compatto in italiano che mantenga solo le "
+    "informazioni importanti. Non inventare fatti nuovi e non cambiare il "
+    "significato. Limita il riassunto a poche frasi o pochi punti elenco brevi. "
+    "Rispondi SOLO con il testo del riassunto, senza aggiungere spiegazioni meta."
+)
+
+
+# alias (it/en) accettati nell'input → enum; costanti in sola lettura
+SCOPE_MAP: Mapping[str, MemoryScope] = MappingProxyType(
+    {
+        "conversation": MemoryScope.CONVERSATION,
+        "project": MemoryScope.PROJECT,
+        "progetto": MemoryScope.PROJECT,
+        "user": MemoryScope.USER,
+        "utente": MemoryScope.USER,
+        "global": MemoryScope.GLOBAL,
+        "globale": MemoryScope.GLOBAL,
+    }
+)
+
+TYPE_MAP: Mapping[str, MemoryType] = MappingProxyType(
+    {
+        "episodic": MemoryType.EPISODIC,
+        "episodica": MemoryType.EPISODIC,
+        "semantic": MemoryType.SEMANTIC,
+        "semantica": MemoryType.SEMANTIC,
+        "procedural": MemoryType.PROCEDURAL,
+        "procedurale": MemoryType.PROCEDURAL,
+    }
+)
+
+
+@dataclass(slots=True)
+class ArchivistParams:
+    """
+    Parametri di input dell'ArchivistAgent, già normalizzati.
+    """
+
+    scope: MemoryScope = MemoryScope.CONVERSATION
+    type_: Optional[MemoryType] = None
+    query: Optional[str] = None
+    max_items: int = 50
+    summary_key: str = ""
+
+    @classmethod
+    def from_payload(cls, input_payload: Dict[str, Any]) -> "ArchivistParams":
+        scope_str = str(input_payload.get("scope", "conversation")).lower()
+        scope = SCOPE_MAP.get(scope_str, MemoryScope.CONVERSATION)
+
+        type_str = input_payload.get("type")
+        type_: Optional[MemoryType] = None
+        if type_str:
+            t = str(type_str).lower()
+            type_ = TYPE_MAP.get(t)
+
+        max_items_raw = input_payload.get("max_items", 50)
+        try:
+            max_items = int(max_items_raw)
+        except Exception:
+            max_items = 50
+        max_items = max(1, min(max_items, 200))  # clamp tra 1 e 200
+
+        return cls(
+            scope=scope,
+            type_=type_,
+            query=input_payload.get("query"),
+            max_items=max_items,
+            summary_key=input_payload.get(
+                "summary_key",
+                f"archivist_summary_{scope.value}",
+            ),
+        )
 
 
 class ArchivistAgent(Agent):
@@ -41,44 +121,12 @@ class ArchivistAgent(Agent):
         # -------------------------
         # 1) Parsing parametri
         # -------------------------
-        scope_str = str(input_payload.get("scope", "conversation")).lower()
-        scope_map = {
-            "conversation": MemoryScope.CONVERSATION,
-            "project": MemoryScope.PROJECT,
-            "progetto": MemoryScope.PROJECT,
-            "user": MemoryScope.USER,
-            "utente": MemoryScope.USER,
-            "global": MemoryScope.GLOBAL,
-            "globale": MemoryScope.GLOBAL,
-        }
-        scope = scope_map.get(scope_str, MemoryScope.CONVERSATION)
-
-        type_str = input_payload.get("type")
-        type_: Optional[MemoryType] = None
-        if type_str:
-            t = str(type_str).lower()
-            type_map = {
-                "episodic": MemoryType.EPISODIC,
-                "episodica": MemoryType.EPISODIC,
-                "semantic": MemoryType.SEMANTIC,
-                "semantica": MemoryType.SEMANTIC,
-                "procedural": MemoryType.PROCEDURAL,
-                "procedurale": MemoryType.PROCEDURAL,
-            }
-            type_ = type_map.get(t)
-
-        query = input_payload.get("query")
-        max_items_raw = input_payload.get("max_items", 50)
-        try:
-            max_items = int(max_items_raw)
-        except Exception:
-            max_items = 50
-        max_items = max(1, min(max_items, 200))  # clamp tra 1 e 200
-
-        summary_key = input_payload.get(
-            "summary_key",
-            f"archivist_summary_{scope.value}",
-        )
+        params = ArchivistParams.from_payload(input_payload)
+        scope = params.scope
+        type_ = params.type_
+        query = params.query
+        max_items = params.max_items
+        summary_key = params.summary_key
 
         # -------------------------
         # 2) Recupero delle memorie
@@ -88,6 +136,7 @@ class ArchivistAgent(Agent):
             type_=type_,
             query=query,
             limit=max_items,
+            oldest_first=True,  # dal più vecchio al più nuovo, già ordinati da SQLite
         )
 
         if not items:
@@ -104,11 +153,9 @@ class ArchivistAgent(Agent):
                 emotion_delta=EmotionDelta(confidence=-0.01, frustration=0.01),
             )
 
-        # Ordino temporalmente (dal più vecchio al più nuovo)
-        sorted_items = sorted(items, key=lambda it: it.created_at)
-
         serializable_items: List[Dict[str, Any]] = []
-        for it in sorted_items:
+        source_ids: List[str] = []
+        for it in items:
             serializable_items.append(
                 {
                     "id": it.id,
@@ -119,19 +166,11 @@ class ArchivistAgent(Agent):
                     "created_at": it.created_at.isoformat(),
                 }
             )
+            source_ids.append(it.id)
 
         # -------------------------
         # 3) Prompt per il riassunto LLM
         # -------------------------
-        system_prompt = (
-            "Sei l'Archivist interno di un sistema multi-agent. "
-            "Ricevi un elenco di memorie (log di conversazione, note, risultati di agent). "
-            "Devi scrivere un riassunto compatto in italiano che mantenga solo le "
-            "informazioni importanti. Non inventare fatti nuovi e non cambiare il "
-            "significato. Limita il riassunto a poche frasi o pochi punti elenco brevi. "
-            "Rispondi SOLO con il testo del riassunto, senza aggiungere spiegazioni meta."
-        )
-
         user_payload = {
             "scope": scope.value,
             "type": type_.value if type_ else None,
@@ -142,20 +181,22 @@ class ArchivistAgent(Agent):
         messages = [
             Message(
                 role=MessageRole.USER,
-                content=json.dumps(user_payload, ensure_ascii=False),
+                content=json_dumps(user_payload),
             )
         ]
 
         # Provo a usare l'LLM; se fallisce, fallback deterministico
         try:
-            summary_text = llm.generate(
-                system_prompt=system_prompt,
+            # stesse memorie → stesso riassunto: riusiamo quello già calcolato
+            summary_text = LLMResponseCache(memory, namespace="archivist_summary").generate(
+                llm,
+                system_prompt=ARCHIVIST_SYSTEM_PROMPT,
                 messages=messages,
                 max_tokens=512,
             )
             llm_failed = False
         except Exception as exc:  # noqa: BLE001
-            joined = "\n\n".join(it.content for it in sorted_items[:5])
+            joined = "\n\n".join([it.content for it in items[:5]])
             summary_text = (
                 "Non sono riuscito a usare il modello LLM per riassumere; "
                 "qui sotto trovi un estratto delle memorie più recenti:\n\n"
@@ -167,11 +208,11 @@ class ArchivistAgent(Agent):
         # 4) Salvataggio del riassunto in memoria
         # -------------------------
         metadata = {
-            "source_item_ids": [it.id for it in sorted_items],
+            "source_item_ids": source_ids,
             "source_scope": scope.value,
             "source_type": type_.value if type_ else None,
             "query": query,
-            "num_items": len(sorted_items),
+            "num_items": len(items),
             "agent": self.name,
             "llm_used": not llm_failed,
         }
@@ -188,7 +229,7 @@ class ArchivistAgent(Agent):
         # 5) Messaggio per l'utente
         # -------------------------
         user_msg = (
-            f"Ho creato un riassunto di {len(sorted_items)} memorie "
+            f"Ho creato un riassunto di {len(items)} memorie "
             f"nello scope «{scope.value}» e l'ho salvato con id «{summary_item.id}» "
             f"e key «{summary_key}».\n\n"
             f"Riassunto:\n{summary_text}"
@@ -205,7 +246,7 @@ class ArchivistAgent(Agent):
             output_payload={
                 "user_visible_message": user_msg,
                 "summary_memory_id": summary_item.id,
-                "archived_item_ids": [it.id for it in sorted_items],
+                "archived_item_ids": source_ids,
             },
             emotion_delta=delta,
         )
@@ -1,19 +1,206 @@
 from __future__ import annotations
 
+import atexit
 import json
+import queue
 import subprocess
+import threading
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 from core.agents_base import Agent, AgentResult
 from core.models import (
     EmotionalState,
     EmotionDelta,
     ConversationContext,
+    Message,
     MessageRole,
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+from core.json_utils import json_dumps, json_loads
+
+
+R_AGENTS_DIR = Path(__file__).resolve().parents[1] / "r_agents"
+CONVERSATION_LOGGER_SCRIPT = R_AGENTS_DIR / "conversation_logger.R"
+# stderr del processo R (errori di RSQLite, DB bloccato, RDS, ...)
+CONVERSATION_LOGGER_LOG = R_AGENTS_DIR / "out" / "conversation_logger.log"
+
+
+class _ConversationLogWriter:
+    """
+    Logging delle conversazioni in R fuori dal percorso della risposta:
+    i job vanno in una coda, un thread daemon li scrive (una riga JSON per
+    job) sullo stdin di un unico processo Rscript di lunga durata, invece
+    di avviare un Rscript nuovo a ogni turno.
+    Lo stderr di R finisce in append su `log_path`.
+    Per ogni job salvato R risponde su stdout con una riga JSON
+    {"ok": true, "conversation_id": ..., "logged_upto": ...}, passata a
+    `on_ack(conversation_id, logged_upto)`.
+    """
+
+    def __init__(
+        self,
+        script: Path,
+        log_path: Path,
+        on_ack: Optional[Callable[[str, int], None]] = None,
+    ) -> None:
+        self.script = script
+        self.log_path = log_path
+        self.on_ack = on_ack
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._proc: Optional[subprocess.Popen] = None
+        self._disabled = False
+
+    def submit(self, job: Dict[str, Any]) -> None:
+        if self._disabled:
+            return
+        with self._lock:
+            if self._thread is None:
+                # avvio pigro: nessun processo R finché non c'è qualcosa da loggare
+                self._thread = threading.Thread(
+                    target=self._run, name="conversation-logger", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+        self._queue.put(job)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Svuota la coda e chiude lo stdin di R (che termina a EOF)."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _ensure_proc(self) -> subprocess.Popen:
+        if self._proc is None or self._proc.poll() is not None:
+            if self._proc is not None:
+                print(
+                    "[WARN] conversation_logger.R terminato con codice "
+                    f"{self._proc.returncode} (dettagli in {self.log_path}); lo riavvio."
+                )
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            # il figlio eredita il descrittore: qui lo possiamo richiudere subito
+            with open(self.log_path, "a", encoding="utf-8") as err:
+                self._proc = subprocess.Popen(
+                    ["Rscript", str(self.script)],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=err,
+                    text=True,
+                    encoding="utf-8",
+                )
+            threading.Thread(
+                target=self._read_acks,
+                args=(self._proc,),
+                name="conversation-logger-acks",
+                daemon=True,
+            ).start()
+        return self._proc
+
+    def _read_acks(self, proc: subprocess.Popen) -> None:
+        # termina a EOF, cioè quando il processo R esce
+        for line in proc.stdout:
+            try:
+                ack = json_loads(line)
+            except ValueError:
+                continue
+            if not isinstance(ack, dict) or ack.get("ok") is not True:
+                continue
+            conversation_id = ack.get("conversation_id")
+            logged_upto = ack.get("logged_upto")
+            if (
+                self.on_ack is not None
+                and isinstance(conversation_id, str)
+                and type(logged_upto) is int
+            ):
+                self.on_ack(conversation_id, logged_upto)
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                proc = self._ensure_proc()
+                proc.stdin.write(json_dumps(job) + "\n")
+                proc.stdin.flush()
+            except FileNotFoundError:
+                print("[WARN] Rscript non trovato nel PATH. Salvataggio in R disabilitato.")
+                self._disabled = True
+                return
+            except OSError as exc:
+                # Non bloccare la conversazione se il logging fallisce
+                print("[WARN] conversation_logger.R error:", exc)
+                self._proc = None
+
+        if self._proc is not None and self._proc.stdin is not None:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+
+
+# conversation_id → numero di messaggi del context che R ha confermato di
+# aver salvato. Avanza solo alla conferma: un job perso (pipe rotta, errore
+# in R) viene recuperato al turno dopo, che riparte dall'ultimo messaggio
+# confermato (R fa INSERT OR IGNORE, i re-invii sono innocui).
+# Limitata alle conversazioni usate più di recente: per una conversazione
+# uscita dalla mappa si reinvia la history.
+LOGGED_UPTO_MAX_CONVERSATIONS = 256
+_LOGGED_UPTO: Dict[str, int] = {}
+_LOGGED_UPTO_LOCK = threading.Lock()
+
+
+def _logged_upto(conversation_id: str) -> int:
+    """Messaggi già salvati da R per la conversazione (0 se nessuno)."""
+    with _LOGGED_UPTO_LOCK:
+        upto = _LOGGED_UPTO.pop(conversation_id, None)
+        if upto is None:
+            return 0
+        # reinserimento: la conversazione passa in fondo (più recente)
+        _LOGGED_UPTO[conversation_id] = upto
+        return upto
+
+
+def _mark_logged(conversation_id: str, upto: int) -> None:
+    """Conferma di R: i primi `upto` messaggi della conversazione sono salvati."""
+    with _LOGGED_UPTO_LOCK:
+        prev = _LOGGED_UPTO.pop(conversation_id, 0)
+        if len(_LOGGED_UPTO) >= LOGGED_UPTO_MAX_CONVERSATIONS:
+            # via la conversazione usata meno di recente (ordine di inserimento)
+            _LOGGED_UPTO.pop(next(iter(_LOGGED_UPTO)))
+        # i job della stessa conversazione possono confermarsi fuori ordine
+        _LOGGED_UPTO[conversation_id] = max(prev, upto)
+
+
+_LOG_WRITER = _ConversationLogWriter(
+    CONVERSATION_LOGGER_SCRIPT,
+    CONVERSATION_LOGGER_LOG,
+    on_ack=_mark_logged,
+)
+
+
+# finestra di contesto (in token) su cui dimensioniamo la history, e
+# token riservati alla risposta
+CHAT_CONTEXT_TOKENS = 4096
+CHAT_REPLY_MAX_TOKENS = 512
+
+
+def _approx_tokens(text: str) -> int:
+    """Stima grezza dei token (~4 caratteri per token), senza tokenizer."""
+    return len(text) // 4 + 1
+
+
+def _bucket(value: float) -> str:
+    """Fascia qualitativa (basso/medio/alto) di un valore emotivo in [0, 1]."""
+    if value < 0.33:
+        return "basso"
+    if value < 0.66:
+        return "medio"
+    return "alto"
 
 
 class ChatAgent(Agent):
@@ -21,9 +208,10 @@ class ChatAgent(Agent):
     Agente conversazionale principale:
     - usa l'LLM provider per generare la risposta
     - costruisce il contesto usando la history della conversazione
-    - include sempre il profilo utente (se esiste) nel prompt
-    - chiama uno script R per salvare l'intera conversazione
-      in .RData e .db (RSQLite).
+    - include sempre il profilo utente (se esiste), come messaggio SYSTEM
+      separato dal system prompt
+    - passa la conversazione a uno script R (processo persistente, in
+      background) che la salva in .rds e .db (RSQLite).
     """
 
     name = "chat_agent"
@@ -56,27 +244,33 @@ class ChatAgent(Agent):
 
         # -----------------------------
         # 1) Costruisco il prompt per l'LLM
+        #    Ordine dal più stabile al più variabile, così il prefisso resta
+        #    riusabile dalla prompt cache del provider:
+        #    system prompt (uguale per tutti) → profilo (per utente) →
+        #    stato emotivo in fasce (cambia tra i turni) → history.
         # -----------------------------
-        system_prompt_parts: List[str] = []
-
-        system_prompt_parts.append(
+        static_parts: List[str] = [
             "Sei un assistente conversazionale che parla con un utente umano. "
             "Rispondi in modo chiaro, sintetico ma utile. "
             "Se l'utente non specifica altro, rispondi in italiano."
-        )
+        ]
 
-        # Stato emotivo (facoltativo, ma utile per futuri adattamenti)
-        system_prompt_parts.append(
-            f"Stato interno approssimato: curiosità={emotional_state.curiosity:.2f}, "
-            f"fiducia={emotional_state.confidence:.2f}, "
-            f"fatica={emotional_state.fatigue:.2f}, "
-            f"frustrazione={emotional_state.frustration:.2f}."
-        )
+        # Stato emotivo (facoltativo, ma utile per futuri adattamenti): varia a ogni turno
+        # (in fasce: piccole variazioni non cambiano il testo del prompt)
+        dynamic_parts: List[str] = [
+            f"Stato interno approssimato: curiosità={_bucket(emotional_state.curiosity)}, "
+            f"fiducia={_bucket(emotional_state.confidence)}, "
+            f"fatica={_bucket(emotional_state.fatigue)}, "
+            f"frustrazione={_bucket(emotional_state.frustration)}."
+        ]
+
+        system_prompt = "\n\n".join(static_parts)
+        state_text = "\n\n".join(dynamic_parts)
 
         # Profilo utente (se disponibile)
         if profile_for_prompt is not None:
             # Importante: vincolo esplicito per evitare invenzioni sul mondo esterno
-            system_prompt_parts.append(
+            profile_parts = [
                 "Hai accesso a un profilo utente interno in formato JSON, che contiene "
                 "informazioni esclusivamente su questa persona (preferenze, hobby, "
                 "topic da evitare, ecc.). "
@@ -84,31 +278,49 @@ class ChatAgent(Agent):
                 "riferimento a sé stesso (es. 'Ludovico Kubler, padre di Sophie'), "
                 "rispondi SOLO usando questo profilo interno e la conversazione "
                 "corrente. NON usare conoscenza esterna sul mondo anche se esistono "
-                "altre persone famose con lo stesso nome."
-            )
-            system_prompt_parts.append(
+                "altre persone famose con lo stesso nome.",
                 "Ecco il profilo utente interno (JSON):\n"
-                + json.dumps(profile_for_prompt, ensure_ascii=False)
-            )
+                + json.dumps(profile_for_prompt, ensure_ascii=False),
+            ]
         else:
-            system_prompt_parts.append(
+            profile_parts = [
                 "Al momento non hai ancora un profilo utente strutturato; "
                 "usa solo ciò che emerge dalla conversazione corrente."
-            )
+            ]
 
-        system_prompt = "\n\n".join(system_prompt_parts)
+        profile_text = "\n\n".join(profile_parts)
 
-        # Prendiamo una finestra degli ultimi N messaggi per il contesto
+        # Prendiamo una finestra degli ultimi N messaggi per il contesto,
+        # scartando i più vecchi finché non rientra nel budget di token
+        # (altrimenti il provider tronca o rifiuta la richiesta)
         max_history = 12
+        budget = (
+            CHAT_CONTEXT_TOKENS
+            - CHAT_REPLY_MAX_TOKENS
+            - _approx_tokens(system_prompt)
+            - _approx_tokens(profile_text)
+            - _approx_tokens(state_text)
+        )
         history = context.messages[-max_history:]
+        used = 0
+        keep = 0
+        for msg in reversed(history):
+            used += _approx_tokens(msg.content)
+            # l'ultimo messaggio (quello dell'utente) va comunque tenuto
+            if used > budget and keep > 0:
+                break
+            keep += 1
+        history = history[len(history) - keep:]
 
         # L'LLM provider si aspetta una lista di 'Message' del nostro modello,
         # possiamo usare direttamente la history più l'ultimo user_message.
-        from core.models import Message
-
-        messages_for_llm: List[Message] = []
-        for msg in history:
-            messages_for_llm.append(msg)
+        # (il messaggio del profilo in testa, poi lo stato emotivo subito
+        # prima della history: se cambia fascia non invalida il profilo)
+        messages_for_llm: List[Message] = [
+            Message(role=MessageRole.SYSTEM, content=profile_text),
+            Message(role=MessageRole.SYSTEM, content=state_text),
+            *history,
+        ]
 
         # L'orchestrator ha già aggiunto il messaggio utente al context
         # prima di chiamare questo agent, quindi lo troviamo in history.
@@ -117,71 +329,60 @@ class ChatAgent(Agent):
         llm_raw = llm.generate(
             system_prompt=system_prompt,
             messages=messages_for_llm,
-            max_tokens=512,
+            max_tokens=CHAT_REPLY_MAX_TOKENS,
         )
 
         reply_text = llm_raw.strip()
 
         # -----------------------------
-        # 2) Preparo un job JSON per R con l'intera conversazione
+        # 2) Preparo un job JSON per R con i messaggi nuovi della conversazione
         #    + la risposta che sto per dare
         # -----------------------------
-        # Costruiamo un vettore di messaggi role/content/timestamp
-        conv_msgs: List[Dict[str, Any]] = []
-        for msg in context.messages:
-            conv_msgs.append(
-                {
-                    "role": msg.role.value,
-                    "content": msg.content,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-            )
+        # Solo i messaggi non ancora confermati dal logger (seq_no = posizione
+        # nella conversazione): R fa INSERT OR IGNORE su (conversation_id, seq_no),
+        # quindi eventuali re-invii sono innocui.
+        conversation_id = context.id
+        start = _logged_upto(conversation_id)
+        conv_msgs: List[Dict[str, Any]] = [
+            {
+                "seq_no": seq_no,
+                "role": msg.role.value,
+                "content": msg.content,
+                "timestamp": msg.timestamp.isoformat(),
+            }
+            for seq_no, msg in enumerate(context.messages[start:], start)
+        ]
 
         # Aggiungiamo la risposta che sto generando ora,
         # così in R hai già user + assistant allineati.
         conv_msgs.append(
             {
+                "seq_no": len(context.messages),
                 "role": MessageRole.ASSISTANT.value,
                 "content": reply_text,
                 "timestamp": None,  # l'orchestrator la metterà dopo, qui è solo log logico
             }
         )
 
-        conversation_id = context.id
-
         job = {
             "conversation_id": conversation_id,
             "user_id": user_id,
             "messages": conv_msgs,
+            # R lo rimanda nella conferma, vedi _mark_logged
+            "logged_upto": len(context.messages),
         }
 
         # -----------------------------
-        # 3) Chiamo Rscript conversation_logger.R
+        # 3) Accodo il job per conversation_logger.R (scrittura in background)
         # -----------------------------
-        project_root = Path(__file__).resolve().parents[1]
-        r_dir = project_root / "r_agents"
-        script = r_dir / "conversation_logger.R"
-
         # Assicuriamoci che la cartella per gli output esista (es. r_agents/out/)
-        out_dir = r_dir / "out"
+        out_dir = R_AGENTS_DIR / "out"
         out_dir.mkdir(parents=True, exist_ok=True)
 
         job["db_path"] = str(out_dir / "conversations.db")
         job["rdata_dir"] = str(out_dir)
 
-        try:
-            cmd = ["Rscript", str(script), json.dumps(job)]
-            proc = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=False,
-            )
-            if proc.returncode != 0:
-                # Non bloccare la conversazione se il logging fallisce
-                print("[WARN] conversation_logger.R error:", proc.stderr.strip())
-        except FileNotFoundError:
-            print("[WARN] Rscript non trovato nel PATH. Salvataggio in R disabilitato.")
+        _LOG_WRITER.submit(job)
 
         # -----------------------------
         # 4) Costruisco il risultato per l'orchestrator
@@ -1,9 +1,16 @@
 # agents/codebase_agent.py
 from __future__ import annotations
 
-import json
+import base64
 import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
@@ -19,32 +26,303 @@ from core.models import (
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+from core.llm_cache import LLMResponseCache
+from core.json_utils import json_dumps, json_loads, safe_json_loads
+
+try:  # hyperscan è opzionale: ricerca con DFA compilato nel fallback senza ripgrep
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+
+# assumiamo che il repo sia la cartella padre rispetto a agents/ (risolto una volta sola)
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+SKIP_DIRS = frozenset(
+    {
+        ".git",
+        ".idea",
+        ".vscode",
+        "__pycache__",
+        ".venv",
+        "venv",
+        "node_modules",
+        "out",
+        "r_agents/out",
+    }
+)
+CODE_EXTENSIONS = frozenset(
+    {
+        ".py",
+        ".R",
+        ".r",
+        ".md",
+        ".txt",
+        ".json",
+        ".yaml",
+        ".yml",
+        ".sql",
+        ".sh",
+    }
+)
+
+# ripgrep (se installato) per le ricerche testuali; altrimenti scansione Python
+RG_PATH: Optional[str] = shutil.which("rg")
 
+# root → (mtime_ns di ogni directory visitata, file di codice trovati)
+_FILE_LIST_CACHE: Dict[Path, Tuple[Dict[str, int], List[Path]]] = {}
 
-def _safe_json_loads(raw: str) -> Optional[dict]:
+
+def _walk_code_files(root: Path) -> Tuple[Dict[str, int], List[Path]]:
     """
-    Utility usata anche in altri agent LLM-based:
-    - prova json.loads diretto,
-    - se fallisce, prova a estrarre il primo blocco {...}.
+    Walk con os.scandir: tipo ed estensione vengono dai DirEntry (nessuno
+    stat extra per file); stesso ordine e stessi filtri del vecchio os.walk.
     """
-    try:
-        val = json.loads(raw)
-        if isinstance(val, dict):
-            return val
-    except Exception:
-        pass
+    dir_mtimes: Dict[str, int] = {}
+    files: List[Path] = []
+
+    def _walk(dirpath: str) -> None:
+        try:
+            dir_mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError:
+            dir_mtimes.setdefault(dirpath, -1)
+            return
+
+        subdirs: List[str] = []
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # filtra dir da saltare (i link a directory non vengono seguiti)
+                if name not in SKIP_DIRS and not name.startswith(".") and not entry.is_symlink():
+                    subdirs.append(entry.path)
+            elif os.path.splitext(name)[1] in CODE_EXTENSIONS:
+                files.append(Path(entry.path))
+
+        for sub in subdirs:
+            _walk(sub)
+
+    _walk(str(root))
+    return dir_mtimes, files
+
+
+def _dirs_unchanged(dir_mtimes: Dict[str, int]) -> bool:
+    # aggiungere/rimuovere/rinominare un file aggiorna l'mtime della sua directory
+    for dirpath, mtime in dir_mtimes.items():
+        try:
+            if os.stat(dirpath).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _cached_code_files(root: Path) -> List[Path]:
+    """
+    Lista dei file di codice sotto root: un stat per directory invece di
+    un nuovo os.walk completo a ogni ricerca.
+    """
+    cached = _FILE_LIST_CACHE.get(root)
+    if cached is not None and _dirs_unchanged(cached[0]):
+        return cached[1]
+
+    dir_mtimes, files = _walk_code_files(root)
+    _FILE_LIST_CACHE[root] = (dir_mtimes, files)
+    return files
+
+
+def _code_tree_signature(root: Path) -> int:
+    """
+    Firma dei file di codice sotto root: mtime delle directory (gli stessi di
+    _cached_code_files: file aggiunti, rimossi o rinominati) più mtime e
+    dimensione di ogni file (modifiche sul posto, es. un modulo riscritto dal
+    CodegenAgent). Un stat per file: molto meno di una nuova scansione.
+    """
+    files = _cached_code_files(root)
+    sig: List[Any] = [frozenset(_FILE_LIST_CACHE[root][0].items())]
+    for path in files:
+        try:
+            st = os.stat(path)
+        except OSError:
+            sig.append(None)
+            continue
+        sig.append((st.st_mtime_ns, st.st_size))
+    return hash(tuple(sig))
+
+
+# query più corte di così: il costo di compilazione non vale la pena
+HYPERSCAN_MIN_QUERY_LEN = 3
+
+
+@lru_cache(maxsize=32)
+def _hs_database(query: str):
+    """Database hyperscan (compilato una volta per query) per la ricerca letterale."""
+    db = hyperscan.Database()
+    db.compile(expressions=[re.escape(query).encode("utf-8")], ids=[0], flags=[0])
+    return db
+
 
+def _hs_match_starts(db, data: bytes, qlen: int) -> List[int]:
+    starts: List[int] = []
+
+    def on_match(id_: int, from_: int, to: int, flags: int, context: Any) -> None:
+        starts.append(to - qlen)
+
+    db.scan(data, match_event_handler=on_match)
+    return starts
+
+
+def _append_line_hits(
+    hits: List[Dict[str, Any]],
+    rel: str,
+    data: bytes,
+    starts: Iterable[int],
+    max_hits: int,
+) -> bool:
+    """
+    Converte gli offset (crescenti) dei match in hit per riga, una per riga.
+    Ritorna True quando hits ha raggiunto max_hits.
+    """
+    line_no = 1
+    pos = 0
+    last_line = 0
+    for start in starts:
+        line_no += data.count(b"\n", pos, start)
+        pos = start
+        if line_no == last_line:
+            continue
+        last_line = line_no
+        line_start = data.rfind(b"\n", 0, start) + 1
+        line_end = data.find(b"\n", start)
+        if line_end == -1:
+            line_end = len(data)
+        hits.append(
+            {
+                "file": rel,
+                "line_no": line_no,
+                "line": data[line_start:line_end].decode("utf-8", errors="ignore").rstrip("\r"),
+            }
+        )
+        if len(hits) >= max_hits:
+            return True
+    return False
+
+
+# thread per la scansione Python dei file (lavoro dominato dall'I/O)
+SEARCH_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+# euristica "file binario": un byte NUL nei primi BINARY_SNIFF_BYTES
+BINARY_SNIFF_BYTES = 4096
+
+
+def _read_searchable(path: Path, max_size: int) -> Optional[bytes]:
+    """
+    Contenuto del file, oppure None se non va cercato: illeggibile, più
+    grande di max_size byte o binario. Lo stat evita di leggere i file grandi.
+    """
     try:
-        start = raw.index("{")
-        end = raw.rindex("}") + 1
-        snippet = raw[start:end]
-        val2 = json.loads(snippet)
-        if isinstance(val2, dict):
-            return val2
-    except Exception:
+        if path.stat().st_size > max_size:
+            return None
+        with path.open("rb") as f:
+            head = f.read(BINARY_SNIFF_BYTES)
+            if b"\x00" in head:
+                return None
+            return head + f.read()
+    except OSError:
         return None
 
-    return None
+
+def _find_all(data: bytes, needle: bytes) -> Iterable[int]:
+    off = data.find(needle)
+    while off != -1:
+        yield off
+        off = data.find(needle, off + len(needle))
+
+
+def _scan_file(
+    path: Path,
+    rel: str,
+    q: str,
+    max_hits: int,
+    max_size: int,
+) -> List[Dict[str, Any]]:
+    """
+    Match di `q` in un singolo file (al massimo max_hits), in ordine di riga.
+    Ricerca sui byte: si decodificano solo le righe che contengono un match.
+    """
+    hits: List[Dict[str, Any]] = []
+    data = _read_searchable(path, max_size)
+    if data:
+        _append_line_hits(hits, rel, data, _find_all(data, q.encode("utf-8")), max_hits)
+    return hits
+
+
+# cache dei risultati di ricerca:
+# (root, firma dei file di codice, query, max_hits) → (timestamp, hit)
+SEARCH_CACHE_TTL = 30.0  # secondi
+SEARCH_CACHE_MAX_ENTRIES = 64
+_SEARCH_CACHE: Dict[Tuple[str, int, str, int], Tuple[float, Tuple[Tuple[str, int, str], ...]]] = {}
+
+
+def _rg_text(obj: Dict[str, Any]) -> str:
+    # ripgrep usa {"text": ...} per UTF-8 valido, {"bytes": base64} altrimenti
+    if "text" in obj:
+        return obj["text"]
+    return base64.b64decode(obj.get("bytes", "")).decode("utf-8", errors="ignore")
+
+
+def _rg_search(root: Path, query: str, max_hits: int) -> List[Dict[str, Any]]:
+    """
+    Ricerca letterale di `query` con ripgrep (--json), con gli stessi filtri
+    di _walk_code_files (SKIP_DIRS, CODE_EXTENSIONS). Si ferma a max_hits.
+    I file sono visitati in ordine di path (--sort path), così il taglio a
+    max_hits è sempre lo stesso e non dipende dai thread di ripgrep.
+    """
+    cmd = [
+        RG_PATH,
+        "--json",
+        "--sort",
+        "path",
+        "--no-messages",
+        "--no-ignore",
+        "--fixed-strings",
+        "--max-count",
+        str(max_hits),
+    ]
+    for ext in sorted(CODE_EXTENSIONS):
+        cmd += ["-g", f"*{ext}"]
+    for d in sorted(SKIP_DIRS):
+        cmd += ["-g", f"!{d}/"]
+    cmd += ["-e", query, "--", str(root)]
+
+    hits: List[Dict[str, Any]] = []
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for raw in proc.stdout:
+            event = json_loads(raw)
+            if event.get("type") != "match":
+                continue
+            data = event["data"]
+            path = Path(_rg_text(data["path"]))
+            hits.append(
+                {
+                    "file": str(path.relative_to(root)),
+                    "line_no": data["line_number"],
+                    "line": _rg_text(data["lines"]).rstrip("\r\n"),
+                }
+            )
+            if len(hits) >= max_hits:
+                break
+    finally:
+        proc.kill()
+        proc.wait()
+    return hits
 
 
 class CodebaseAgent(Agent):
@@ -93,56 +371,25 @@ class CodebaseAgent(Agent):
         "'dove viene usato X?' e costruisce piani di refactoring guidati da LLM."
     )
 
+    # file più grandi di così (tipicamente artefatti .json/.txt) non vengono cercati
+    max_search_file_size = 2 * 1024 * 1024
+
     # ------------------------------------------------------------------ #
     #  Helpers: filesystem / indexing
     # ------------------------------------------------------------------ #
 
     @staticmethod
     def _project_root() -> Path:
-        # assumiamo che il repo sia la cartella padre rispetto a agents/
-        return Path(__file__).resolve().parents[1]
+        return PROJECT_ROOT
 
     @staticmethod
     def _iter_code_files(root: Path) -> Iterable[Path]:
         """
         Itera sui file di codice del progetto, saltando dir rumorose.
+        La lista è in cache per processo e si rifà il walk solo se una
+        delle directory visitate è cambiata (vedi _cached_code_files).
         """
-        skip_dirs = {
-            ".git",
-            ".idea",
-            ".vscode",
-            "__pycache__",
-            ".venv",
-            "venv",
-            "node_modules",
-            "out",
-            "r_agents/out",
-        }
-        allowed_ext = {
-            ".py",
-            ".R",
-            ".r",
-            ".md",
-            ".txt",
-            ".json",
-            ".yaml",
-            ".yml",
-            ".sql",
-            ".sh",
-        }
-
-        for dirpath, dirnames, filenames in os.walk(root):
-            rel_dir = Path(dirpath).relative_to(root)
-            # filtra dir da saltare
-            dirnames[:] = [
-                d for d in dirnames
-                if d not in skip_dirs and not d.startswith(".")
-            ]
-
-            for fname in filenames:
-                path = Path(dirpath) / fname
-                if path.suffix in allowed_ext:
-                    yield path
+        return iter(_cached_code_files(root))
 
     def _build_index(
         self,
@@ -150,38 +397,36 @@ class CodebaseAgent(Agent):
         max_files: int = 500,
     ) -> Dict[str, Any]:
         """
-        Costruisce un indice leggero dei file di codice:
-        - path relativo,
-        - dimensione in byte,
-        - estensione.
+        Costruisce un indice leggero dei file di codice, in colonne parallele:
+        - paths: path relativi,
+        - sizes: dimensioni in byte (None se non leggibile),
+        - exts: estensioni.
         Lo salva in memoria GLOBAL/PROCEDURAL con key='code_index'.
         """
         root = self._project_root()
-        files_info: List[Dict[str, Any]] = []
-        count = 0
+        # colonne parallele (una riga per file) invece di un dict per file
+        paths: List[str] = []
+        sizes: List[Optional[int]] = []
+        exts: List[str] = []
 
         for path in self._iter_code_files(root):
-            rel = path.relative_to(root)
             try:
                 size = path.stat().st_size
             except OSError:
                 size = None
 
-            files_info.append(
-                {
-                    "path": str(rel),
-                    "size": size,
-                    "ext": path.suffix,
-                }
-            )
-            count += 1
-            if count >= max_files:
+            paths.append(str(path.relative_to(root)))
+            sizes.append(size)
+            exts.append(sys.intern(path.suffix))  # poche estensioni distinte
+            if len(paths) >= max_files:
                 break
 
         index_obj = {
             "root": str(root),
-            "num_files": len(files_info),
-            "files": files_info,
+            "num_files": len(paths),
+            "paths": paths,
+            "sizes": sizes,
+            "exts": exts,
         }
 
         try:
@@ -189,10 +434,10 @@ class CodebaseAgent(Agent):
                 scope=MemoryScope.GLOBAL,
                 type_=MemoryType.PROCEDURAL,
                 key="code_index",
-                content=json.dumps(index_obj, ensure_ascii=False),
+                content=json_dumps(index_obj),
                 metadata={
                     "agent": self.name,
-                    "num_files": len(files_info),
+                    "num_files": len(paths),
                 },
             )
         except Exception:
@@ -210,31 +455,86 @@ class CodebaseAgent(Agent):
         Cerca in tutti i file di codice il testo 'query'.
         Ritorna una lista di match:
           { "file": "...", "line_no": 42, "line": "..." }
+        La stessa ricerca ripetuta entro SEARCH_CACHE_TTL secondi (es. un
+        refactor_plan rilanciato cambiando solo il goal) riusa i risultati,
+        purché nessun file di codice sia cambiato nel frattempo.
         """
+        if not query:
+            return []
+
         root = self._project_root()
+        cache_key = (str(root), _code_tree_signature(root), query, max_hits)
+        now = time.monotonic()
+        cached = _SEARCH_CACHE.get(cache_key)
+        if cached is not None and now - cached[0] < SEARCH_CACHE_TTL:
+            return [
+                {"file": f, "line_no": n, "line": line}
+                for f, n, line in cached[1]
+            ]
+
+        hits = self._scan_occurrences(root, query, max_hits)
+
+        if len(_SEARCH_CACHE) >= SEARCH_CACHE_MAX_ENTRIES:
+            # via la voce più vecchia (i dict mantengono l'ordine di inserimento)
+            _SEARCH_CACHE.pop(next(iter(_SEARCH_CACHE)))
+        _SEARCH_CACHE.pop(cache_key, None)
+        _SEARCH_CACHE[cache_key] = (
+            now,
+            tuple((h["file"], h["line_no"], h["line"]) for h in hits),
+        )
+        return hits
+
+    def _scan_occurrences(
+        self,
+        root: Path,
+        query: str,
+        max_hits: int,
+    ) -> List[Dict[str, Any]]:
+        """Ricerca vera e propria (ripgrep, hyperscan o scansione Python), senza cache."""
         q = query
         hits: List[Dict[str, Any]] = []
 
-        if not q:
+        if RG_PATH is not None:
+            try:
+                return _rg_search(root, q, max_hits)
+            except (OSError, ValueError):
+                hits = []  # ripgrep non utilizzabile: scansione Python
+
+        if hyperscan is not None and len(q) >= HYPERSCAN_MIN_QUERY_LEN:
+            db = _hs_database(q)
+            qlen = len(q.encode("utf-8"))
+            for path in self._iter_code_files(root):
+                data = _read_searchable(path, self.max_search_file_size)
+                if not data:
+                    continue
+                starts = _hs_match_starts(db, data, qlen)
+                if starts and _append_line_hits(
+                    hits, str(path.relative_to(root)), data, starts, max_hits
+                ):
+                    return hits
             return hits
 
-        for path in self._iter_code_files(root):
-            rel = path.relative_to(root)
-            try:
-                with path.open("r", encoding="utf-8", errors="ignore") as f:
-                    for line_no, line in enumerate(f, start=1):
-                        if q in line:
-                            hits.append(
-                                {
-                                    "file": str(rel),
-                                    "line_no": line_no,
-                                    "line": line.rstrip("\n"),
-                                }
-                            )
-                            if len(hits) >= max_hits:
-                                return hits
-            except OSError:
-                continue
+        # Scansione in parallelo; map() mantiene l'ordine dei file, così i
+        # risultati (e il taglio a max_hits) restano quelli della scansione seriale
+        files = list(self._iter_code_files(root))
+        pool = ThreadPoolExecutor(max_workers=SEARCH_MAX_WORKERS)
+        try:
+            results = pool.map(
+                lambda path: _scan_file(
+                    path,
+                    str(path.relative_to(root)),
+                    q,
+                    max_hits,
+                    self.max_search_file_size,
+                ),
+                files,
+            )
+            for file_hits in results:
+                hits.extend(file_hits)
+                if len(hits) >= max_hits:
+                    return hits[:max_hits]
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
 
         return hits
 
@@ -455,17 +755,21 @@ class CodebaseAgent(Agent):
         messages = [
             Message(
                 role=MessageRole.USER,
-                content=json.dumps(llm_input, ensure_ascii=False),
+                content=json_dumps(llm_input),
             )
         ]
 
         try:
-            raw = llm.generate(
+            # stesso obiettivo + stessi match → stesso piano: riusiamo quello salvato
+            # (solo risposte JSON valide, così un output rotto verrà rigenerato)
+            raw = LLMResponseCache(memory, namespace="refactor_plan").generate(
+                llm,
                 system_prompt=system_prompt,
                 messages=messages,
+                should_cache=lambda r: safe_json_loads(r) is not None,
                 max_tokens=900,
             )
-            parsed = _safe_json_loads(raw) or {}
+            parsed = safe_json_loads(raw) or {}
         except Exception:
             parsed = {}
 
@@ -517,9 +821,8 @@ class CodebaseAgent(Agent):
                 scope=scope,
                 type_=MemoryType.PROCEDURAL,
                 key="refactor_plan",
-                content=json.dumps(
-                    {"plan_summary": plan_summary, "steps": steps, "notes": notes},
-                    ensure_ascii=False,
+                content=json_dumps(
+                    {"plan_summary": plan_summary, "steps": steps, "notes": notes}
                 ),
                 metadata=metadata,
             )
@@ -2,8 +2,31 @@
 from __future__ import annotations
 
 import os
-import textwrap
-from typing import Any, Dict, List, Optional
+import py_compile
+import stat
+import sys
+import tempfile
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from core.agents_base import Agent, AgentResult
+from core.models import AgentRunStatus, EmotionalState, EmotionDelta, ConversationContext
+from core.memory import MemoryEngine
+from core.llm_provider import LLMProvider
+
+
+# Template dei sorgenti generati, costruiti una volta all'import: per ogni
+# agent si fa solo la sostituzione dei campi con str.format
+# (le graffe letterali sono raddoppiate: {{ }}).
+
+# Template Python: già "usabile".
+# - legge user_message da input_payload o dal contesto,
+# - se SYSTEM_PROMPT è definito, chiama l'LLM in single-shot,
+# - altrimenti risponde in modo neutro.
+PYTHON_AGENT_TEMPLATE = '''# Auto-generated by CodegenAgent
+from __future__ import annotations
+
+from typing import Any, Dict
 
 from core.agents_base import Agent, AgentResult
 from core.models import EmotionalState, EmotionDelta, ConversationContext
@@ -11,6 +34,411 @@ from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
 
 
+class {class_name}(Agent):
+    """
+    {description}
+    (Generato automaticamente da CodegenAgent.)
+    """
+
+    name = "{agent_name}"
+    description = "{description}"
+
+    SYSTEM_PROMPT = """{prompt_escaped}"""
+
+    def _run_impl(
+        self,
+        input_payload: Dict[str, Any],
+        context: ConversationContext,
+        memory: MemoryEngine,
+        llm: LLMProvider,
+        emotional_state: EmotionalState,
+    ) -> AgentResult:
+        # Recupera il messaggio utente principale:
+        # 1) da input_payload["user_message"]
+        # 2) altrimenti dall'ultimo messaggio USER nel contesto, se disponibile.
+        user_message = input_payload.get("user_message") or (
+            context.messages[-1].content if context.messages else ""
+        )
+
+        if self.SYSTEM_PROMPT:
+            from core.models import Message, MessageRole  # import locale per evitare cicli
+
+            messages = [
+                Message(role=MessageRole.USER, content=user_message),
+            ]
+            llm_output = llm.generate(
+                system_prompt=self.SYSTEM_PROMPT,
+                messages=messages,
+                max_tokens=512,
+            )
+            text = llm_output
+        else:
+            text = (
+                "Sono un agent generato automaticamente. "
+                "Non ho ancora una logica specifica oltre a questo messaggio di placeholder."
+            )
+
+        output = {{
+            "user_visible_message": text,
+            "stop_for_user_input": False,
+        }}
+        delta = EmotionDelta()
+        return AgentResult(output_payload=output, emotion_delta=delta)
+'''
+
+# Template R con protocollo standard:
+# - legge JSON da stdin (o args),
+# - parse con jsonlite::fromJSON,
+# - restituisce un JSON "echo" arricchito.
+R_AGENT_TEMPLATE = """# Auto-generated R agent script for '{agent_name}'
+# Descrizione: {description}
+# NOTE:
+# - Legge JSON da stdin (o, se vuoto, da un argomento di fallback).
+# - Restituisce JSON su stdout con un payload generico.
+
+suppressPackageStartupMessages(library(jsonlite))
+
+system_prompt <- "{prompt_comment}"
+
+read_input_json <- function() {{
+  # Prova a leggere tutto lo stdin
+  input_lines <- tryCatch(
+    readLines(con = "stdin", warn = FALSE),
+    error = function(e) character(0)
+  )
+  txt <- paste(input_lines, collapse = "\\n")
+
+  if (nzchar(txt)) {{
+    return(txt)
+  }}
+
+  # Fallback: se non c'è niente su stdin, usa il primo argomento (se sembra un JSON)
+  args <- commandArgs(trailingOnly = TRUE)
+  if (length(args) > 0) {{
+    return(args[[1]])
+  }}
+
+  return("")
+}}
+
+main <- function() {{
+  raw_json <- read_input_json()
+
+  if (!nzchar(raw_json)) {{
+    result <- list(
+      agent = "{agent_name}",
+      status = "error",
+      message = "Nessun input JSON ricevuto (stdin vuoto e nessun argomento).",
+      input = NULL,
+      system_prompt = system_prompt
+    )
+    cat(jsonlite::toJSON(result, auto_unbox = TRUE, null = "null"))
+    return(invisible(NULL))
+  }}
+
+  input_obj <- NULL
+  parse_error <- NULL
+  try {{
+    input_obj <- jsonlite::fromJSON(raw_json, simplifyVector = TRUE)
+  }} catch (e) {{
+    parse_error <- as.character(e)
+  }}
+
+  if (!is.null(parse_error)) {{
+    result <- list(
+      agent = "{agent_name}",
+      status = "error",
+      message = "Errore nel parse del JSON di input.",
+      parse_error = parse_error,
+      raw = raw_json,
+      system_prompt = system_prompt
+    )
+    cat(jsonlite::toJSON(result, auto_unbox = TRUE, null = "null"))
+    return(invisible(NULL))
+  }}
+
+  # Qui potrai implementare la logica analitica reale.
+  # Per ora facciamo un semplice "echo" dell'input.
+  result <- list(
+    agent = "{agent_name}",
+    status = "ok",
+    message = "Skeleton R agent generated. Implementa qui la logica reale.",
+    input = input_obj,
+    system_prompt = system_prompt
+  )
+
+  cat(jsonlite::toJSON(result, auto_unbox = TRUE, null = "null"))
+}}
+
+if (identical(environment(), globalenv())) {{
+  main()
+}}
+"""
+
+
+# Delta emotivi ricorrenti, creati una volta all'import invece che a ogni run.
+# Sono condivisi tra tutte le esecuzioni: vanno trattati in sola lettura.
+DELTA_FILE_CREATED = EmotionDelta(confidence=0.04, curiosity=0.02)
+DELTA_NO_FILE = EmotionDelta(confidence=0.0, curiosity=0.02)
+DELTA_NEUTRAL = EmotionDelta()
+
+
+# Risultati dei rami d'errore con messaggio fisso, anch'essi condivisi
+# (e quindi in sola lettura).
+RESULT_NO_LIST_METHOD = AgentResult(
+    output_payload={
+        "user_visible_message": (
+            "CodegenAgent: MemoryEngine non espone list_agent_definitions()."
+        ),
+        "stop_for_user_input": False,
+    },
+    emotion_delta=DELTA_NEUTRAL,
+)
+RESULT_NO_DEFINITIONS = AgentResult(
+    output_payload={
+        "user_visible_message": (
+            "CodegenAgent: nessuna AgentDefinition trovata in memoria."
+        ),
+        "stop_for_user_input": False,
+    },
+    emotion_delta=DELTA_NEUTRAL,
+)
+
+
+# campi stringa della config che si ripetono tra definizioni (tipo, modulo, ...)
+INTERNED_CONFIG_KEYS = ("type", "module", "class_name", "r_script_path")
+
+
+def _intern_definition(definition: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Interna (sys.intern) le stringhe ricorrenti di una AgentDefinition, così
+    i valori ripetuti tra definizioni sono condivisi e i confronti successivi
+    (id, tipo) si risolvono sul puntatore. Modifica il dict in place.
+    """
+    for key in ("id", "name"):
+        val = definition.get(key)
+        if type(val) is str:
+            definition[key] = sys.intern(val)
+    cfg = definition.get("config")
+    if isinstance(cfg, dict):
+        for key in INTERNED_CONFIG_KEYS:
+            val = cfg.get(key)
+            if type(val) is str:
+                cfg[key] = sys.intern(val)
+    return definition
+
+
+def _default_class_name(definition: Dict[str, Any]) -> str:
+    """
+    Nome della classe Python derivato dal nome normalizzato
+    ("pdf_reader" → "PdfReaderAgent").
+    """
+    name = _normalized_name(definition)
+    if name.replace("_", "").isalpha():
+        # solo lettere: title() in C dà lo stesso CamelCase di capitalize() per parte
+        class_name = name.replace("_", " ").title().replace(" ", "")
+    else:
+        # con cifre/simboli title() ricomincia la maiuscola dopo ogni
+        # non-lettera ("v2x" → "V2X"): teniamo la derivazione originale
+        class_name = "".join(part.capitalize() for part in name.split("_"))
+    if not class_name.endswith("Agent"):
+        class_name += "Agent"
+    return class_name
+
+
+def _escaped_prompt(cfg: Dict[str, Any]) -> str:
+    """
+    System prompt della definizione già pronto per la stringa tripla del
+    sorgente Python (\"\"\" escapate).
+    """
+    return cfg.get("system_prompt_template", "").strip().replace('"""', '\\"""')
+
+
+PATH_SEP = os.sep
+
+
+def _join_under(base_dir: str, rel_path: str) -> str:
+    """
+    Equivalente di os.path.join(base_dir, rel_path) per un rel_path relativo
+    (i path generati lo sono sempre): una sola concatenazione, senza passare
+    per la logica generale di posixpath/ntpath.join.
+    """
+    if not base_dir:
+        return rel_path
+    if base_dir.endswith(PATH_SEP):
+        return base_dir + rel_path
+    return f"{base_dir}{PATH_SEP}{rel_path}"
+
+
+def _normalized_name(definition: Dict[str, Any]) -> str:
+    """
+    Nome dell'agent in forma snake_case ("Pdf Reader" → "pdf_reader").
+    """
+    return definition.get("name", "custom_agent").strip().lower().replace(" ", "_")
+
+
+def _load_definition(
+    memory: MemoryEngine,
+    target_id: Optional[str],
+) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Carica la AgentDefinition da generare: quella con id `target_id`
+    (lookup per primary key) oppure l'ultima creata, senza scorrere tutta
+    la tabella. Ritorna (definizione, has_defs); has_defs=False se non
+    esiste nessuna definizione.
+    """
+    if target_id and hasattr(memory, "get_agent_definition"):
+        found = memory.get_agent_definition(target_id)
+        return (_intern_definition(found) if found else None), True
+    if not target_id and hasattr(memory, "get_latest_agent_definition"):
+        latest = memory.get_latest_agent_definition()
+        return (_intern_definition(latest) if latest else None), latest is not None
+
+    defs = memory.list_agent_definitions()
+    if not defs:
+        return None, False
+    if target_id:
+        by_id = {d["id"]: d for d in defs}
+        found = by_id.get(target_id)
+        return (_intern_definition(found) if found else None), True
+    return _intern_definition(defs[-1]), True  # ultima definizione
+
+
+def _dir_entries(dir_cache: Dict[str, Set[str]], directory: str) -> Set[str]:
+    """
+    Nomi dei file presenti in `directory` (creata se manca), letti con un
+    solo scandir per directory e riusati per tutta la run: niente
+    makedirs/stat per ogni file generato nella stessa cartella.
+    """
+    entries = dir_cache.get(directory)
+    if entries is None:
+        os.makedirs(directory, exist_ok=True)
+        with os.scandir(directory) as it:
+            entries = {entry.name for entry in it}
+        dir_cache[directory] = entries
+    return entries
+
+
+@lru_cache(maxsize=1)
+def _default_file_mode() -> int:
+    """
+    Permessi di un file nuovo creato con open(): 0o666 meno la umask.
+    La umask si legge solo impostandola, quindi una volta per processo.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _file_mode_for(file_path: str) -> int:
+    """
+    Permessi da dare al sorgente rigenerato: quelli del file esistente,
+    altrimenti quelli di un file nuovo (vedi _default_file_mode).
+    """
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except OSError:
+        return _default_file_mode()
+
+
+def _write_all(pending: List[Tuple[str, str]], durable: bool = False) -> Dict[str, Exception]:
+    """
+    Scrive in un solo passaggio tutti i sorgenti generati (path, codice):
+    per ogni file un'unica write(2) sui byte UTF-8 già codificati (niente
+    TextIOWrapper e traduzione dei newline).
+
+    Ogni sorgente viene scritto in un file temporaneo nella stessa directory
+    e poi rinominato sul path finale (os.replace, atomico su POSIX): chi
+    legge agents/ non vede mai un modulo scritto a metà, nemmeno se il
+    processo muore durante la scrittura.
+
+    Con durable=True, a scritture finite, fa fsync di ogni file e poi una
+    sola fsync per ciascuna directory coinvolta (group commit), invece di
+    sincronizzare a ogni scrittura. Ritorna {path: eccezione} dei fallimenti.
+    """
+    errors: Dict[str, Exception] = {}
+    opened: List[Tuple[str, str, int]] = []  # (path finale, path temporaneo, fd)
+    try:
+        for file_path, code in pending:
+            try:
+                data = memoryview(code.encode("utf-8"))
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(file_path) or ".",
+                    prefix=".codegen_",
+                    suffix=".tmp",
+                )
+            except Exception as exc:  # noqa: BLE001
+                errors[file_path] = exc
+                continue
+            opened.append((file_path, tmp_path, fd))
+            try:
+                # su file regolari basta una write; il ciclo copre le scritture parziali
+                while data:
+                    data = data[os.write(fd, data):]
+            except Exception as exc:  # noqa: BLE001
+                errors[file_path] = exc
+
+        if durable:
+            for file_path, _, fd in opened:
+                if file_path in errors:
+                    continue
+                try:
+                    os.fsync(fd)
+                except OSError as exc:
+                    errors[file_path] = exc
+    finally:
+        for _, _, fd in opened:
+            os.close(fd)
+
+    for file_path, tmp_path, _ in opened:
+        try:
+            if file_path not in errors:
+                # mkstemp crea il file 0600: si riprendono i permessi che il
+                # file avrebbe avuto scritto direttamente sul path finale
+                os.chmod(tmp_path, _file_mode_for(file_path))
+                os.replace(tmp_path, file_path)
+                continue
+        except OSError as exc:
+            errors[file_path] = exc
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    if durable:
+        # la directory va sincronizzata perché il rename sopravviva a un crash
+        dirs = {os.path.dirname(p) or "." for p, _, _ in opened if p not in errors}
+        for d in dirs:
+            try:
+                dir_fd = os.open(d, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+            except OSError:
+                continue  # es. Windows: fsync delle directory non supportata
+            try:
+                os.fsync(dir_fd)
+            except OSError:
+                pass
+            finally:
+                os.close(dir_fd)
+
+    return errors
+
+
+def _prime_bytecode(file_paths: List[str]) -> None:
+    """
+    Compila subito i sorgenti Python appena scritti nel loro .pyc in
+    __pycache__ (header con mtime/size corretti, via py_compile): il primo
+    import dal loader dinamico fa solo l'unmarshal del bytecode.
+    Best effort: se la compilazione fallisce, ci penserà l'import a segnalarlo.
+    """
+    if sys.dont_write_bytecode:
+        return
+    for file_path in file_paths:
+        try:
+            py_compile.compile(file_path, doraise=True)
+        except (py_compile.PyCompileError, OSError):
+            pass
+
+
 class CodegenAgent(Agent):
     """
     Genera codice sorgente per nuovi agent a partire da una AgentDefinition
@@ -22,6 +450,10 @@ class CodegenAgent(Agent):
 
     Non registra l'agent nel registry (ci pensa il loader dinamico),
     ma aggiorna la AgentDefinition con informazioni sul file generato.
+
+    Con input_payload["target_ids"] (lista di id) genera più definizioni
+    nella stessa esecuzione: una sola scrittura dei file e un solo
+    salvataggio su SQLite per tutto il batch.
     """
 
     name = "codegen_agent"
@@ -39,112 +471,194 @@ class CodegenAgent(Agent):
         # 1) Recupera le AgentDefinition
         # ------------------------------------------------------------------
         if not hasattr(memory, "list_agent_definitions"):
+            return RESULT_NO_LIST_METHOD
+
+        # flag booleani: valgono solo se sono davvero True (i payload arrivano da
+        # JSON); così ad es. la stringa "false" non attiva overwrite per sbaglio
+        get = input_payload.get
+        base_dir_python = get("base_dir_python") or "agents"
+        base_dir_r = get("base_dir_r") or "r_agents"
+        overwrite = get("overwrite_existing") is True
+        dry_run = get("dry_run") is True
+        durable = get("durable") is True
+
+        # target_ids (lista) → batch; altrimenti target_id opzionale,
+        # e senza nessuno dei due prendo l'ultima definizione
+        target_ids = get("target_ids")
+        if isinstance(target_ids, str):
+            # un id singolo passato come stringa, non da iterare carattere per carattere
+            target_ids = [target_ids]
+        elif target_ids and not isinstance(target_ids, (list, tuple)):
             return AgentResult(
                 output_payload={
                     "user_visible_message": (
-                        "CodegenAgent: MemoryEngine non espone list_agent_definitions()."
+                        "CodegenAgent: target_ids deve essere una lista di id "
+                        f"(ricevuto {type(target_ids).__name__})."
                     ),
                     "stop_for_user_input": False,
                 },
-                emotion_delta=EmotionDelta(),
+                emotion_delta=DELTA_NEUTRAL,
+                status=AgentRunStatus.FAILURE,
             )
-
-        defs = memory.list_agent_definitions()
-        if not defs:
-            return AgentResult(
-                output_payload={
-                    "user_visible_message": (
-                        "CodegenAgent: nessuna AgentDefinition trovata in memoria."
-                    ),
-                    "stop_for_user_input": False,
-                },
-                emotion_delta=EmotionDelta(),
+        batch = bool(target_ids)
+        missing: List[str] = []
+        if batch:
+            # una sola lettura della tabella per tutto il batch (id duplicati ignorati)
+            by_id = {d["id"]: d for d in memory.list_agent_definitions()}
+            has_defs = bool(by_id)
+            candidates: List[Dict[str, Any]] = []
+            for tid in dict.fromkeys(target_ids):
+                found = by_id.get(tid)
+                if found is None:
+                    missing.append(str(tid))
+                else:
+                    candidates.append(_intern_definition(found))
+            not_found_msg = (
+                "CodegenAgent: nessuna delle AgentDefinition richieste è stata trovata "
+                f"({', '.join(missing)})."
             )
-
-        # target_id opzionale, altrimenti prendo l'ultima definizione
-        target_id = input_payload.get("target_id")
-        candidate: Optional[Dict[str, Any]] = None
-        if target_id:
-            for d in defs:
-                if d["id"] == target_id:
-                    candidate = d
-                    break
         else:
-            candidate = defs[-1]
+            target_id = get("target_id")
+            candidate, has_defs = _load_definition(memory, target_id)
+            candidates = [candidate] if candidate is not None else []
+            not_found_msg = f"CodegenAgent: AgentDefinition con id '{target_id}' non trovata."
 
-        if candidate is None:
+        if not has_defs:
+            return RESULT_NO_DEFINITIONS
+
+        if not candidates:
             return AgentResult(
                 output_payload={
-                    "user_visible_message": (
-                        f"CodegenAgent: AgentDefinition con id '{target_id}' non trovata."
-                    ),
+                    "user_visible_message": not_found_msg,
                     "stop_for_user_input": False,
                 },
-                emotion_delta=EmotionDelta(),
+                emotion_delta=DELTA_NEUTRAL,
             )
 
-        cfg: Dict[str, Any] = candidate.get("config", {}) or {}
-
-        agent_type = cfg.get("type", "python")
-        if agent_type not in ("python", "r"):
-            agent_type = "python"
-
-        base_dir_python = input_payload.get("base_dir_python", "agents")
-        base_dir_r = input_payload.get("base_dir_r", "r_agents")
-        overwrite = bool(input_payload.get("overwrite_existing", False))
-        dry_run = bool(input_payload.get("dry_run", False))
-
         # ------------------------------------------------------------------
-        # 2) Genera codice in base al tipo
+        # 2) Genera codice in base al tipo (solo rendering, niente I/O)
         # ------------------------------------------------------------------
-        if agent_type == "python":
-            result = self._generate_python_agent(
-                definition=candidate,
-                cfg=cfg,
-                base_dir=base_dir_python,
-                overwrite=overwrite,
-                dry_run=dry_run,
-            )
-        else:
-            result = self._generate_r_agent(
-                definition=candidate,
-                cfg=cfg,
-                base_dir=base_dir_r,
-                overwrite=overwrite,
-                dry_run=dry_run,
-            )
+        # contenuto delle directory di output, letto una volta per run
+        dir_cache: Dict[str, Set[str]] = {}
+        runs: List[Tuple[Dict[str, Any], str, Dict[str, Any]]] = []
+        for candidate in candidates:
+            cfg: Dict[str, Any] = candidate.get("config", {}) or {}
+
+            agent_type = cfg.get("type", "python")
+            if agent_type not in ("python", "r"):
+                agent_type = "python"
+
+            if agent_type == "python":
+                result = self._generate_python_agent(
+                    definition=candidate,
+                    cfg=cfg,
+                    base_dir=base_dir_python,
+                    overwrite=overwrite,
+                    dry_run=dry_run,
+                    dir_cache=dir_cache,
+                )
+            else:
+                result = self._generate_r_agent(
+                    definition=candidate,
+                    cfg=cfg,
+                    base_dir=base_dir_r,
+                    overwrite=overwrite,
+                    dry_run=dry_run,
+                    dir_cache=dir_cache,
+                )
+            runs.append((candidate, agent_type, result))
 
-        # Se abbiamo aggiornato la definizione (es. module/class_name/r_script_path),
-        # riscriviamola su SQLite
-        if result["updated_definition"]:
+        # ------------------------------------------------------------------
+        # 3) Scrittura di tutti i file generati in un solo passaggio
+        #    (con fsync solo se richiesto: durable=True)
+        # ------------------------------------------------------------------
+        pending = [
+            (result["file_path"], code)
+            for _, _, result in runs
+            if (code := result.get("code")) is not None
+        ]
+        write_errors = _write_all(pending, durable=durable) if pending else {}
+        created = False
+        created_python: List[str] = []
+        for _, agent_type, result in runs:
+            if result.pop("code", None) is None:
+                continue
+            is_python = agent_type == "python"
+            label = "Python" if is_python else "R"
+            file_path = result["file_path"]
+            messages = result["messages"]
+            exc = write_errors.get(file_path)
+            if exc is not None:
+                messages.append(f"❌ Errore durante la scrittura del file {label}: {exc}")
+            else:
+                result["file_created"] = created = True
+                messages.append(f"✅ File {label} generato: {file_path}")
+                if is_python:
+                    created_python.append(file_path)
+
+        _prime_bytecode(created_python)
+
+        # Se abbiamo aggiornato delle definizioni (es. module/class_name/r_script_path),
+        # riscriviamole su SQLite, tutte in una transazione se la memoria lo permette
+        updated = [(candidate, result) for candidate, _, result in runs if result["updated_definition"]]
+        if updated:
+            save_error: Optional[str] = None
             try:
-                memory.save_agent_definition(candidate)
+                if hasattr(memory, "save_agent_definitions"):
+                    memory.save_agent_definitions([candidate for candidate, _ in updated])
+                elif hasattr(memory, "save_agent_definition"):
+                    for candidate, _ in updated:
+                        memory.save_agent_definition(candidate)
+                else:
+                    save_error = (
+                        "⚠️ MemoryEngine non espone save_agent_definition(): "
+                        "AgentDefinition aggiornata solo in questa esecuzione."
+                    )
             except Exception as exc:  # noqa: BLE001
-                result["messages"].append(
-                    f"⚠️ Errore nel salvataggio aggiornato della AgentDefinition: {exc}"
-                )
+                save_error = f"⚠️ Errore nel salvataggio aggiornato della AgentDefinition: {exc}"
+            if save_error is not None:
+                for _, result in updated:
+                    result["messages"].append(save_error)
 
         # ------------------------------------------------------------------
-        # 3) Costruisci messaggio per l'utente
+        # 4) Costruisci messaggio per l'utente
         # ------------------------------------------------------------------
-        lines: List[str] = []
-        lines.append(f"Codegen su AgentDefinition '{candidate['name']}' (id={candidate['id']})")
-        lines.extend(result["messages"])
-
-        user_msg = "\n".join(lines)
-
+        sections: List[str] = []
+        for candidate, _, result in runs:
+            header = f"Codegen su AgentDefinition '{candidate['name']}' (id={candidate['id']})"
+            messages = result["messages"]
+            # caso comune: un solo messaggio → concatenazione diretta, senza lista + join
+            if len(messages) == 1:
+                sections.append(f"{header}\n{messages[0]}")
+            elif not messages:
+                sections.append(header)
+            else:
+                sections.append("\n".join([header, *messages]))
+        if missing:
+            sections.append(f"⚠️ AgentDefinition non trovate: {', '.join(missing)}")
+
+        user_msg = "\n\n".join(sections)
+
+        _, first_type, first_result = runs[0]
         output = {
             "user_visible_message": user_msg,
             "stop_for_user_input": False,
-            "file_path": result.get("file_path"),
-            "agent_type": agent_type,
+            "file_path": first_result["file_path"],
+            "agent_type": first_type,
             "dry_run": dry_run,
         }
+        if batch:
+            output["results"] = [
+                {
+                    "id": candidate["id"],
+                    "agent_type": agent_type,
+                    "file_path": result["file_path"],
+                    "file_created": result["file_created"],
+                }
+                for candidate, agent_type, result in runs
+            ]
 
-        delta = EmotionDelta(
-            confidence=0.04 if result.get("file_created") else 0.0,
-            curiosity=0.02,
-        )
+        delta = DELTA_FILE_CREATED if created else DELTA_NO_FILE
         return AgentResult(output_payload=output, emotion_delta=delta)
 
     # ------------------------------------------------------------------
@@ -157,11 +671,12 @@ class CodegenAgent(Agent):
         base_dir: str,
         overwrite: bool,
         dry_run: bool,
+        dir_cache: Optional[Dict[str, Set[str]]] = None,
     ) -> Dict[str, Any]:
         messages: List[str] = []
         updated_definition = False
 
-        name = definition.get("name", "custom_agent").strip().lower().replace(" ", "_")
+        name = _normalized_name(definition)
         desc = definition.get("description", "").strip() or f"Agent generato automaticamente ({name})."
 
         # module / class_name: se mancanti, li deriviamo
@@ -174,9 +689,7 @@ class CodegenAgent(Agent):
             updated_definition = True
 
         if not class_name:
-            class_name = "".join(part.capitalize() for part in name.split("_"))
-            if not class_name.endswith("Agent"):
-                class_name += "Agent"
+            class_name = _default_class_name(definition)
             cfg["class_name"] = class_name
             updated_definition = True
 
@@ -188,12 +701,12 @@ class CodegenAgent(Agent):
             # modulo fuori dal package agents → lo trattiamo comunque sotto base_dir
             rel = module
 
-        rel_path = rel.replace(".", os.sep) + ".py"
-        file_path = os.path.join(base_dir, rel_path)
+        file_path = _join_under(base_dir, f"{rel.replace('.', PATH_SEP)}.py")
 
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        directory, file_name = os.path.split(file_path)
+        entries = _dir_entries(dir_cache if dir_cache is not None else {}, directory)
 
-        if os.path.exists(file_path) and not overwrite and not dry_run:
+        if file_name in entries and not overwrite and not dry_run:
             messages.append(
                 f"⚠️ Il file '{file_path}' esiste già. Usa overwrite_existing=True per sovrascrivere."
             )
@@ -204,39 +717,38 @@ class CodegenAgent(Agent):
                 "updated_definition": updated_definition,
             }
 
-        system_prompt_template = cfg.get("system_prompt_template", "").strip()
+        if dry_run:
+            # il dry_run mostra solo il path: inutile renderizzare il sorgente
+            messages.append("Modalità dry_run: non ho scritto nessun file.")
+            messages.append("Anteprima del path di file:")
+            messages.append(f"  - {file_path}")
+            return {
+                "file_created": False,
+                "file_path": file_path,
+                "messages": messages,
+                "updated_definition": updated_definition,
+                "code": None,
+            }
 
         # corpo dell'agent Python generato
         code = self._render_python_agent_code(
             class_name=class_name,
             agent_name=name,
             description=desc,
-            system_prompt_template=system_prompt_template,
+            prompt_escaped=_escaped_prompt(cfg),
         )
 
-        if dry_run:
-            messages.append("Modalità dry_run: non ho scritto nessun file.")
-            messages.append("Anteprima del path di file:")
-            messages.append(f"  - {file_path}")
-        else:
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(code)
-                messages.append(f"✅ File Python generato: {file_path}")
-            except Exception as exc:  # noqa: BLE001
-                messages.append(f"❌ Errore durante la scrittura del file Python: {exc}")
-                return {
-                    "file_created": False,
-                    "file_path": file_path,
-                    "messages": messages,
-                    "updated_definition": updated_definition,
-                }
+        # lo segno subito: un'altra definizione della stessa run con lo
+        # stesso path lo vedrà come già esistente
+        entries.add(file_name)
 
+        # la scrittura vera e propria la fa _run_impl (vedi _write_all)
         return {
-            "file_created": not dry_run,
+            "file_created": False,
             "file_path": file_path,
             "messages": messages,
             "updated_definition": updated_definition,
+            "code": code,
         }
 
     def _render_python_agent_code(
@@ -244,79 +756,16 @@ class CodegenAgent(Agent):
         class_name: str,
         agent_name: str,
         description: str,
-        system_prompt_template: str,
+        prompt_escaped: str,
     ) -> str:
-        # normalizziamo il prompt in una stringa tripla
-        prompt_escaped = system_prompt_template.replace('"""', '\\"""')
-
-        # Template Python: già "usabile".
-        # - legge user_message da input_payload o dal contesto,
-        # - se SYSTEM_PROMPT è definito, chiama l'LLM in single-shot,
-        # - altrimenti risponde in modo neutro.
-        code = f'''# Auto-generated by CodegenAgent
-from __future__ import annotations
-
-from typing import Any, Dict
-
-from core.agents_base import Agent, AgentResult
-from core.models import EmotionalState, EmotionDelta, ConversationContext
-from core.memory import MemoryEngine
-from core.llm_provider import LLMProvider
-
-
-class {class_name}(Agent):
-    """
-    {description}
-    (Generato automaticamente da CodegenAgent.)
-    """
-
-    name = "{agent_name}"
-    description = "{description}"
-
-    SYSTEM_PROMPT = """{prompt_escaped}"""
-
-    def _run_impl(
-        self,
-        input_payload: Dict[str, Any],
-        context: ConversationContext,
-        memory: MemoryEngine,
-        llm: LLMProvider,
-        emotional_state: EmotionalState,
-    ) -> AgentResult:
-        # Recupera il messaggio utente principale:
-        # 1) da input_payload["user_message"]
-        # 2) altrimenti dall'ultimo messaggio USER nel contesto, se disponibile.
-        user_message = input_payload.get("user_message") or (
-            context.messages[-1].content if context.messages else ""
+        # prompt_escaped: già normalizzato per la stringa tripla (vedi _escaped_prompt)
+        return PYTHON_AGENT_TEMPLATE.format(
+            class_name=class_name,
+            agent_name=agent_name,
+            description=description,
+            prompt_escaped=prompt_escaped,
         )
 
-        if self.SYSTEM_PROMPT:
-            from core.models import Message, MessageRole  # import locale per evitare cicli
-
-            messages = [
-                Message(role=MessageRole.USER, content=user_message),
-            ]
-            llm_output = llm.generate(
-                system_prompt=self.SYSTEM_PROMPT,
-                messages=messages,
-                max_tokens=512,
-            )
-            text = llm_output
-        else:
-            text = (
-                "Sono un agent generato automaticamente. "
-                "Non ho ancora una logica specifica oltre a questo messaggio di placeholder."
-            )
-
-        output = {{
-            "user_visible_message": text,
-            "stop_for_user_input": False,
-        }}
-        delta = EmotionDelta()
-        return AgentResult(output_payload=output, emotion_delta=delta)
-'''
-        return textwrap.dedent(code)
-
     # ------------------------------------------------------------------
     #  R
     # ------------------------------------------------------------------
@@ -327,11 +776,12 @@ class {class_name}(Agent):
         base_dir: str,
         overwrite: bool,
         dry_run: bool,
+        dir_cache: Optional[Dict[str, Set[str]]] = None,
     ) -> Dict[str, Any]:
         messages: List[str] = []
         updated_definition = False
 
-        name = definition.get("name", "custom_agent").strip().lower().replace(" ", "_")
+        name = _normalized_name(definition)
         desc = definition.get("description", "").strip() or f"R agent generato automaticamente ({name})."
 
         r_script_path = cfg.get("r_script_path")
@@ -343,11 +793,12 @@ class {class_name}(Agent):
         file_path = r_script_path
         # se è un path relativo, prepend base_dir se non già presente
         if not os.path.isabs(file_path) and not file_path.startswith(base_dir):
-            file_path = os.path.join(base_dir, os.path.basename(file_path))
+            file_path = _join_under(base_dir, os.path.basename(file_path))
 
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        directory, file_name = os.path.split(file_path)
+        entries = _dir_entries(dir_cache if dir_cache is not None else {}, directory)
 
-        if os.path.exists(file_path) and not overwrite and not dry_run:
+        if file_name in entries and not overwrite and not dry_run:
             messages.append(
                 f"⚠️ Il file R '{file_path}' esiste già. Usa overwrite_existing=True per sovrascrivere."
             )
@@ -358,6 +809,19 @@ class {class_name}(Agent):
                 "updated_definition": updated_definition,
             }
 
+        if dry_run:
+            # il dry_run mostra solo il path: inutile renderizzare il sorgente
+            messages.append("Modalità dry_run: non ho scritto nessun file R.")
+            messages.append("Anteprima del path di file:")
+            messages.append(f"  - {file_path}")
+            return {
+                "file_created": False,
+                "file_path": file_path,
+                "messages": messages,
+                "updated_definition": updated_definition,
+                "code": None,
+            }
+
         system_prompt_template = cfg.get("system_prompt_template", "").strip()
 
         code = self._render_r_agent_code(
@@ -366,29 +830,17 @@ class {class_name}(Agent):
             system_prompt_template=system_prompt_template,
         )
 
-        if dry_run:
-            messages.append("Modalità dry_run: non ho scritto nessun file R.")
-            messages.append("Anteprima del path di file:")
-            messages.append(f"  - {file_path}")
-        else:
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(code)
-                messages.append(f"✅ File R generato: {file_path}")
-            except Exception as exc:  # noqa: BLE001
-                messages.append(f"❌ Errore durante la scrittura del file R: {exc}")
-                return {
-                    "file_created": False,
-                    "file_path": file_path,
-                    "messages": messages,
-                    "updated_definition": updated_definition,
-                }
+        # lo segno subito: un'altra definizione della stessa run con lo
+        # stesso path lo vedrà come già esistente
+        entries.add(file_name)
 
+        # la scrittura vera e propria la fa _run_impl (vedi _write_all)
         return {
-            "file_created": not dry_run,
+            "file_created": False,
             "file_path": file_path,
             "messages": messages,
             "updated_definition": updated_definition,
+            "code": code,
         }
 
     def _render_r_agent_code(
@@ -397,94 +849,10 @@ class {class_name}(Agent):
         description: str,
         system_prompt_template: str,
     ) -> str:
-        # Template R con protocollo standard:
-        # - legge JSON da stdin (o args),
-        # - parse con jsonlite::fromJSON,
-        # - restituisce un JSON "echo" arricchito.
         prompt_comment = system_prompt_template.replace("\n", " ")
 
-        code = f"""# Auto-generated R agent script for '{agent_name}'
-# Descrizione: {description}
-# NOTE:
-# - Legge JSON da stdin (o, se vuoto, da un argomento di fallback).
-# - Restituisce JSON su stdout con un payload generico.
-
-suppressPackageStartupMessages(library(jsonlite))
-
-system_prompt <- "{prompt_comment}"
-
-read_input_json <- function() {{
-  # Prova a leggere tutto lo stdin
-  input_lines <- tryCatch(
-    readLines(con = "stdin", warn = FALSE),
-    error = function(e) character(0)
-  )
-  txt <- paste(input_lines, collapse = "\\n")
-
-  if (nzchar(txt)) {{
-    return(txt)
-  }}
-
-  # Fallback: se non c'è niente su stdin, usa il primo argomento (se sembra un JSON)
-  args <- commandArgs(trailingOnly = TRUE)
-  if (length(args) > 0) {{
-    return(args[[1]])
-  }}
-
-  return("")
-}}
-
-main <- function() {{
-  raw_json <- read_input_json()
-
-  if (!nzchar(raw_json)) {{
-    result <- list(
-      agent = "{agent_name}",
-      status = "error",
-      message = "Nessun input JSON ricevuto (stdin vuoto e nessun argomento).",
-      input = NULL,
-      system_prompt = system_prompt
-    )
-    cat(jsonlite::toJSON(result, auto_unbox = TRUE, null = "null"))
-    return(invisible(NULL))
-  }}
-
-  input_obj <- NULL
-  parse_error <- NULL
-  try {{
-    input_obj <- jsonlite::fromJSON(raw_json, simplifyVector = TRUE)
-  }} catch (e) {{
-    parse_error <- as.character(e)
-  }}
-
-  if (!is.null(parse_error)) {{
-    result <- list(
-      agent = "{agent_name}",
-      status = "error",
-      message = "Errore nel parse del JSON di input.",
-      parse_error = parse_error,
-      raw = raw_json,
-      system_prompt = system_prompt
-    )
-    cat(jsonlite::toJSON(result, auto_unbox = TRUE, null = "null"))
-    return(invisible(NULL))
-  }}
-
-  # Qui potrai implementare la logica analitica reale.
-  # Per ora facciamo un semplice "echo" dell'input.
-  result <- list(
-    agent = "{agent_name}",
-    status = "ok",
-    message = "Skeleton R agent generated. Implementa qui la logica reale.",
-    input = input_obj,
-    system_prompt = system_prompt
-  )
-
-  cat(jsonlite::toJSON(result, auto_unbox = TRUE, null = "null"))
-}}
-
-if (identical(environment(), globalenv())) {{
-  main()
-}}
-"""
-        return code
+        return R_AGENT_TEMPLATE.format(
+            agent_name=agent_name,
+            description=description,
+            prompt_comment=prompt_comment,
+        )
@@ -1,9 +1,10 @@
 # agents/critic_agent.py
 from __future__ import annotations
 
-import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from core.agents_base import Agent, AgentResult, ACTIVE_REGISTRY
 from core.models import (
@@ -18,6 +19,7 @@ from core.models import (
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+from core.json_utils import json_dumps, json_dumps_prefix, safe_json_loads
 
 # Riutilizziamo il profilo utente per tarare il livello di dettaglio
 try:
@@ -40,28 +42,65 @@ except ImportError:  # fallback minimale
         }
 
 
-def _safe_json_loads(raw: str) -> Optional[dict]:
-    """
-    Come negli altri agent: prova json.loads, poi estrai il blocco {...}.
-    """
-    try:
-        val = json.loads(raw)
-        if isinstance(val, dict):
-            return val
-    except Exception:
-        pass
-
-    try:
-        start = raw.index("{")
-        end = raw.rindex("}") + 1
-        snippet = raw[start:end]
-        val2 = json.loads(snippet)
-        if isinstance(val2, dict):
-            return val2
-    except Exception:
-        return None
+# system prompt del Critic: parte statica, costruita una sola volta; la
+# formattazione aggiunge solo il livello di dettaglio ({detail_instruction})
+CRITIC_SYSTEM_PROMPT_TEMPLATE = (
+    "Sei un revisore tecnico e di governance per un sistema multi-agent.\n"
+    "Input:\n"
+    "- metriche di diagnostica (failure_rate, total_runs, avg_duration) per ciascun agent,\n"
+    "- esecuzioni recenti (recent_runs),\n"
+    "- snapshot dei piani pianificati (plan_snapshot: PLAN_CREATED + agents_usage),\n"
+    "- elenco sintetico delle agent_definitions (nome, lifecycle_state, is_active),\n"
+    "- eventuale ultimo risultato di security_review_agent.\n\n"
+    "Compiti:\n"
+    "1) Valutare la qualità dei risultati (chiarezza, correttezza, stabilità) per ogni agent rilevante.\n"
+    "2) Suggerire eventuali re-run con parametri diversi o agent alternativi.\n"
+    "3) Produrre suggerimenti di governance per il CuratorAgent, in modo CONSERVATIVO:\n"
+    "   - proponi 'promote' solo se failure_rate è basso e l'agent è usato nei piani,\n"
+    "   - proponi 'demote' o 'deprecated' solo se ci sono forti segnali: molti fallimenti, warning di sicurezza.\n\n"
+    "Rispondi OBBLIGATORIAMENTE con un JSON valido con struttura minima:\n"
+    "{{\n"
+    '  \"summary\": \"breve riassunto generale in italiano\",\n'
+    '  \"quality_assessment\": [\n'
+    "    {{\n"
+    '      \"agent_name\": \"string\",\n'
+    '      \"quality\": \"buona|media|problematica\",\n'
+    '      \"issues\": [\"stringa\", \"...\"],\n'
+    '      \"recommendations\": [\"stringa\", \"...\"]\n'
+    "    }}\n"
+    "  ],\n"
+    '  \"rerun_suggestions\": [\n'
+    "    {{\n"
+    '      \"agent_name\": \"string\",\n'
+    '      \"reason\": \"perché vale la pena rifare il run\",\n'
+    '      \"suggested_params\": {{\"chiave\": \"valore\"}}\n'
+    "    }}\n"
+    "  ],\n"
+    '  \"governance_suggestions\": [\n'
+    "    {{\n"
+    '      \"agent_name\": \"string\",\n'
+    '      \"action\": \"promote|demote|keep\",\n'
+    '      \"target_state\": \"draft|test|active|deprecated|null\",\n'
+    '      \"confidence\": 0.0,\n'
+    '      \"reason\": \"spiega brevemente il perché\"\n'
+    "    }}\n"
+    "  ],\n"
+    '  \"user_visible_message\": \"testo leggibile per l\\\'utente finale\"\n'
+    "}}\n\n"
+    "REGOLE DI GOVERNANCE:\n"
+    "- Sii molto cauto nel proporre 'deprecated': usalo solo per agent con fallimenti gravi/ricorrenti o segnalati da security_review.\n"
+    "- Se non hai abbastanza informazioni per un agent, usa action=\"keep\" e target_state=null.\n"
+    "- Non cambiare lo stato di agent che non compaiono né nei piani né nei run recenti.\n\n"
+    "{detail_instruction}\n"
+    "Se non hai abbastanza informazioni per alcune sezioni, lasciale vuote."
+)
 
-    return None
+
+# thread per le letture del contesto in parallelo (profilo, metriche, run, piani, ...)
+CONTEXT_LOAD_MAX_WORKERS = 8
+
+# review senza target: una per agent definito (i più recenti), in un unico batch
+SWEEP_MAX_AGENTS = 12
 
 
 class CriticAgent(Agent):
@@ -79,7 +118,11 @@ class CriticAgent(Agent):
     Input atteso (input_payload):
       {
         "target_agent": "nome_agent_opzionale",
-        "lookback_runs": 40,      # quanti run considerare (clamp 10–200)
+        "target_agents": ["agent_a", "agent_b"],  # review separate, in un'unica chiamata batch
+        # senza target_agent/target_agents: una review per ciascuna agent_definition
+        # (al più SWEEP_MAX_AGENTS, le più recenti), sempre in un'unica chiamata batch;
+        # se non ci sono definizioni, una review complessiva di tutti i run
+        "lookback_runs": 40,      # quanti run considerare, del target_agent se indicato (clamp 10–200)
         "max_examples": 10,       # quante esecuzioni sintetizzare per l'LLM
         "include_plans": true     # se includere snapshot dei PLAN_CREATED
       }
@@ -100,12 +143,16 @@ class CriticAgent(Agent):
         "con parametri diversi e produce suggerimenti di governance per CuratorAgent."
     )
 
+    def __init__(self) -> None:
+        # (memory, revisione DB di agent_definitions, brief) dell'ultima costruzione
+        self._defs_cache: Optional[Tuple[MemoryEngine, int, List[Dict[str, Any]]]] = None
+
     # ------------------------------------------------------------------ #
     #  Helpers interni
     # ------------------------------------------------------------------ #
 
     def _load_user_profile(self, context: ConversationContext, memory: MemoryEngine) -> Dict[str, Any]:
-        user_id = getattr(context, "user_id", None) or "unknown"
+        user_id = context.user_id or "unknown"
         profile_key = f"user_profile:{user_id}"
         raw_profile = memory.load_item_content(
             key=profile_key,
@@ -121,16 +168,18 @@ class CriticAgent(Agent):
         lookback_runs: int,
         max_examples: int,
     ) -> List[Dict[str, Any]]:
+        # ordine, filtro per agent e limite li applica già SQLite
         try:
-            runs = memory.get_recent_agent_runs(limit=lookback_runs)
+            runs = memory.get_recent_agent_runs(
+                limit=min(lookback_runs, max_examples),
+                agent_name=target_agent,
+                newest_first=True,
+            )
         except Exception:
             return []
 
         filtered: List[Dict[str, Any]] = []
-        for r in reversed(runs):  # dal più recente al meno recente
-            if target_agent and r.agent_name != target_agent:
-                continue
-
+        for r in runs:  # dal più recente al meno recente
             output = r.output_payload or {}
             content_snippet = ""
 
@@ -139,21 +188,18 @@ class CriticAgent(Agent):
                 if isinstance(msg, str) and msg:
                     content_snippet = msg[:300]
                 else:
-                    raw = json.dumps(output, ensure_ascii=False)
-                    content_snippet = raw[:300]
+                    content_snippet = json_dumps_prefix(output, 300)
 
+            # niente started_at/finished_at: le durate arrivano già
+            # aggregate da agent_metrics (avg_duration)
             filtered.append(
                 {
                     "agent_name": r.agent_name,
                     "status": r.status.value,
-                    "started_at": r.started_at.isoformat() if r.started_at else None,
-                    "finished_at": r.finished_at.isoformat() if r.finished_at else None,
                     "input_payload": r.input_payload,
                     "output_snippet": content_snippet,
                 }
             )
-            if len(filtered) >= max_examples:
-                break
 
         return filtered
 
@@ -162,55 +208,64 @@ class CriticAgent(Agent):
         memory: MemoryEngine,
         context: ConversationContext,
         target_agent: Optional[str],
-        limit_events: int = 200,
+        limit_events: int = 50,
     ) -> Dict[str, Any]:
         """
-        Estrae da events i PLAN_CREATED (e in futuro i TASK_ASSIGNED) per dare
-        al Critic una vista sul routing/planning reale.
+        Estrae da events gli ultimi `limit_events` PLAN_CREATED (e in futuro i
+        TASK_ASSIGNED) per dare al Critic una vista sul routing/planning reale.
         """
-        correlation_id = getattr(context, "correlation_id", None)
+        correlation_id = context.correlation_id
         try:
             events = memory.get_events(
                 correlation_id=correlation_id,
                 limit=limit_events,
+                types=[EventType.PLAN_CREATED],
             )
         except Exception:
             return {"plan_events": [], "agents_usage": {}}
 
         plan_events: List[Dict[str, Any]] = []
-        agents_usage: Dict[str, Dict[str, Any]] = {}
-
-        for ev in events:
-            if ev.type == EventType.PLAN_CREATED:
-                payload = ev.payload or {}
-                tasks = payload.get("tasks", []) or []
-                agents_in_plan: List[str] = []
-                for t in tasks:
-                    agent_name = t.get("agent") or t.get("agent_name")
-                    if not agent_name:
-                        continue
-                    if target_agent and agent_name != target_agent:
-                        # se filtriamo su un agent specifico, saltiamo gli altri
-                        continue
-                    agents_in_plan.append(agent_name)
-                    stats = agents_usage.setdefault(
-                        agent_name,
-                        {"planned_count": 0, "last_seen_at": None},
-                    )
-                    stats["planned_count"] += 1
-                    stats["last_seen_at"] = ev.timestamp.isoformat()
-
-                plan_events.append(
-                    {
-                        "event_id": ev.id,
-                        "timestamp": ev.timestamp.isoformat(),
-                        "correlation_id": ev.correlation_id,
-                        "governance_mode": payload.get("governance_mode"),
-                        "source": payload.get("source", "unknown"),
-                        "num_tasks": len(tasks),
-                        "agents": agents_in_plan,
-                    }
-                )
+        planned_count: Dict[str, int] = defaultdict(int)
+        last_seen_at: Dict[str, str] = {}
+
+        for ev in events:  # già solo PLAN_CREATED
+            payload = ev.payload or {}
+            tasks = payload.get("tasks") or []
+            timestamp = ev.timestamp.isoformat()
+
+            # due varianti del loop: col filtro su target_agent il nome del
+            # task serve solo per il confronto
+            if target_agent:
+                agents_in_plan: List[str] = [
+                    target_agent
+                    for t in tasks
+                    if (t.get("agent") or t.get("agent_name")) == target_agent
+                ]
+            else:
+                agents_in_plan = [
+                    agent_name
+                    for agent_name in (t.get("agent") or t.get("agent_name") for t in tasks)
+                    if agent_name
+                ]
+
+            for agent_name in agents_in_plan:
+                planned_count[agent_name] += 1
+                last_seen_at[agent_name] = timestamp
+
+            plan_events.append(
+                {
+                    "timestamp": timestamp,
+                    "governance_mode": payload.get("governance_mode"),
+                    "source": payload.get("source", "unknown"),
+                    "num_tasks": len(tasks),
+                    "agents": agents_in_plan,
+                }
+            )
+
+        agents_usage: Dict[str, Dict[str, Any]] = {
+            agent_name: {"planned_count": count, "last_seen_at": last_seen_at[agent_name]}
+            for agent_name, count in planned_count.items()
+        }
 
         return {
             "plan_events": plan_events,
@@ -241,30 +296,32 @@ class CriticAgent(Agent):
         if not hasattr(memory, "list_agent_definitions"):
             return []
 
+        # Registro invariato dall'ultima review → stesso brief, senza rileggere il DB
+        revision: Optional[int] = None
+        if hasattr(memory, "agent_definitions_revision"):
+            revision = memory.agent_definitions_revision()
+            cached = self._defs_cache
+            if cached is not None and cached[0] is memory and cached[1] == revision:
+                return cached[2]
+
         try:
             defs = memory.list_agent_definitions()
         except Exception:
             return []
 
-        brief_list: List[Dict[str, Any]] = []
-        for d in defs:
-            created_at = d.get("created_at")
-            if isinstance(created_at, datetime):
-                created_at_str = created_at.isoformat()
-            else:
-                created_at_str = str(created_at) if created_at is not None else None
+        # solo i campi che servono alla governance (vedi system prompt):
+        # id, descrizione, parent e date allungherebbero il prompt per nulla
+        brief_list: List[Dict[str, Any]] = [
+            {
+                "name": d.get("name"),
+                "is_active": bool(d.get("is_active", False)),
+                "lifecycle_state": d.get("lifecycle_state", "draft"),
+            }
+            for d in defs
+        ]
 
-            brief_list.append(
-                {
-                    "id": d.get("id"),
-                    "name": d.get("name"),
-                    "description": d.get("description"),
-                    "is_active": bool(d.get("is_active", False)),
-                    "lifecycle_state": d.get("lifecycle_state", "draft"),
-                    "parent_id": d.get("parent_id"),
-                    "created_at": created_at_str,
-                }
-            )
+        if revision is not None:
+            self._defs_cache = (memory, revision, brief_list)
         return brief_list
 
     # ------------------------------------------------------------------ #
@@ -281,6 +338,9 @@ class CriticAgent(Agent):
     ) -> AgentResult:
         # Parametri
         target_agent = input_payload.get("target_agent")
+        target_agents = input_payload.get("target_agents") or []
+        if isinstance(target_agents, str):
+            target_agents = [target_agents]
         lookback_runs = int(input_payload.get("lookback_runs", 40))
         max_examples = int(input_payload.get("max_examples", 10))
         include_plans = bool(input_payload.get("include_plans", True))
@@ -288,24 +348,72 @@ class CriticAgent(Agent):
         lookback_runs = max(10, min(lookback_runs, 200))
         max_examples = max(3, min(max_examples, 30))
 
-        # Profilo utente → livello di dettaglio
-        user_profile = self._load_user_profile(context, memory)
+        # Definizioni agent (per lifecycle_state / is_active): servono subito
+        # per scegliere i target della sweep (in cache finché il registro non cambia)
+        agent_definitions_brief = self._collect_agent_definitions_brief(memory)
+
+        # Una review per target: ogni agent ha il suo prompt e le richieste
+        # partono in un unico batch. Senza target esplicito la sweep copre le
+        # agent_definitions (le più recenti); i target senza run vengono saltati
+        targets: List[Optional[str]]
+        if target_agent:
+            targets = [target_agent]
+        elif target_agents:
+            targets = list(dict.fromkeys(str(a) for a in target_agents))
+        else:
+            names = [d["name"] for d in agent_definitions_brief if d.get("name")]
+            targets = list(dict.fromkeys(names[-SWEEP_MAX_AGENTS:])) or [None]
+        batch_mode = len(targets) > 1
+
+        # Letture del contesto indipendenti tra loro: partono tutte insieme
+        # (ogni chiamata al MemoryEngine apre la sua connessione SQLite)
+        workers = min(CONTEXT_LOAD_MAX_WORKERS, 3 + 2 * len(targets))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            profile_future = pool.submit(self._load_user_profile, context, memory)
+            metrics_future = pool.submit(memory.get_agent_metrics_from_diagnostics)
+            runs_futures = {
+                name: pool.submit(
+                    self._collect_runs_summary,
+                    memory=memory,
+                    target_agent=name,
+                    lookback_runs=lookback_runs,
+                    max_examples=max_examples,
+                )
+                for name in targets
+            }
+            plan_futures = {
+                name: pool.submit(
+                    self._collect_plan_snapshot,
+                    memory=memory,
+                    context=context,
+                    target_agent=name,
+                )
+                for name in targets
+                if include_plans
+            }
+            security_future = pool.submit(self._find_last_security_review, memory)
+
+            # Profilo utente → livello di dettaglio
+            user_profile = profile_future.result()
+
+            # Metriche dai diagnostics (failure_rate, avg_duration, ecc.)
+            agent_metrics = metrics_future.result()
+
+            # Riassunto delle ultime esecuzioni (i target senza run vengono saltati)
+            runs_by_target: Dict[Optional[str], List[Dict[str, Any]]] = {}
+            for name, future in runs_futures.items():
+                runs_summary = future.result()
+                if runs_summary:
+                    runs_by_target[name] = runs_summary
+
+            # Ultimo security_review (se esiste)
+            security_review_last = security_future.result()
+
         interaction = user_profile.get("interaction_style", {})
         prefers_short = bool(interaction.get("prefers_short_answers", False))
         likes_tech = bool(interaction.get("likes_technical_detail", True))
 
-        # Metriche dai diagnostics (failure_rate, avg_duration, ecc.)
-        agent_metrics = memory.get_agent_metrics_from_diagnostics()
-
-        # Riassunto delle ultime esecuzioni
-        runs_summary = self._collect_runs_summary(
-            memory=memory,
-            target_agent=target_agent,
-            lookback_runs=lookback_runs,
-            max_examples=max_examples,
-        )
-
-        if not runs_summary:
+        if not runs_by_target:
             msg = "CriticAgent: non ho esecuzioni recenti su cui fare una review."
             return AgentResult(
                 output_payload={
@@ -320,35 +428,29 @@ class CriticAgent(Agent):
                 emotion_delta=EmotionDelta(confidence=-0.01),
             )
 
-        # Snapshot dei piani (eventi PLAN_CREATED) e uso agent nei piani
-        plan_snapshot: Dict[str, Any] = {"plan_events": [], "agents_usage": {}}
-        if include_plans:
-            plan_snapshot = self._collect_plan_snapshot(
-                memory=memory,
-                context=context,
-                target_agent=target_agent,
-            )
-
-        # Ultimo security_review (se esiste)
-        security_review_last = self._find_last_security_review(memory)
-
-        # Definizioni agent (per lifecycle_state / is_active)
-        agent_definitions_brief = self._collect_agent_definitions_brief(memory)
+        # Costruiamo un input per l'LLM per ogni target
+        reviewed = list(runs_by_target)
+        llm_inputs: List[Dict[str, Any]] = []
+        for name in reviewed:
+            # Snapshot dei piani (eventi PLAN_CREATED) e uso agent nei piani
+            plan_snapshot: Dict[str, Any] = {"plan_events": [], "agents_usage": {}}
+            if include_plans:
+                plan_snapshot = plan_futures[name].result()
 
-        # Costruiamo input per l'LLM
-        llm_input = {
-            "target_agent": target_agent,
-            "user_profile": user_profile,
-            "interaction_style": {
-                "prefers_short_answers": prefers_short,
-                "likes_technical_detail": likes_tech,
-            },
-            "agent_metrics": agent_metrics,
-            "recent_runs": runs_summary,
-            "plan_snapshot": plan_snapshot,
-            "agent_definitions": agent_definitions_brief,
-            "security_review_last": security_review_last,
-        }
+            llm_inputs.append(
+                {
+                    "target_agent": name,
+                    "interaction_style": {
+                        "prefers_short_answers": prefers_short,
+                        "likes_technical_detail": likes_tech,
+                    },
+                    "agent_metrics": agent_metrics,
+                    "recent_runs": runs_by_target[name],
+                    "plan_snapshot": plan_snapshot,
+                    "agent_definitions": agent_definitions_brief,
+                    "security_review_last": security_review_last,
+                }
+            )
 
         detail_instruction = (
             "Scrivi una valutazione sintetica a bullet point, con poche frasi, "
@@ -357,70 +459,35 @@ class CriticAgent(Agent):
             else "Puoi fornire un'analisi anche tecnica, con qualche dettaglio su errori, parametri e possibili miglioramenti."
         )
 
-        system_prompt = (
-            "Sei un revisore tecnico e di governance per un sistema multi-agent.\n"
-            "Input:\n"
-            "- metriche di diagnostica (failure_rate, total_runs, avg_duration) per ciascun agent,\n"
-            "- esecuzioni recenti (recent_runs),\n"
-            "- snapshot dei piani pianificati (plan_snapshot: PLAN_CREATED + agents_usage),\n"
-            "- elenco sintetico delle agent_definitions (nome, lifecycle_state, is_active),\n"
-            "- eventuale ultimo risultato di security_review_agent.\n\n"
-            "Compiti:\n"
-            "1) Valutare la qualità dei risultati (chiarezza, correttezza, stabilità) per ogni agent rilevante.\n"
-            "2) Suggerire eventuali re-run con parametri diversi o agent alternativi.\n"
-            "3) Produrre suggerimenti di governance per il CuratorAgent, in modo CONSERVATIVO:\n"
-            "   - proponi 'promote' solo se failure_rate è basso e l'agent è usato nei piani,\n"
-            "   - proponi 'demote' o 'deprecated' solo se ci sono forti segnali: molti fallimenti, warning di sicurezza.\n\n"
-            "Rispondi OBBLIGATORIAMENTE con un JSON valido con struttura minima:\n"
-            "{\n"
-            '  \"summary\": \"breve riassunto generale in italiano\",\n'
-            '  \"quality_assessment\": [\n'
-            "    {\n"
-            '      \"agent_name\": \"string\",\n'
-            '      \"quality\": \"buona|media|problematica\",\n'
-            '      \"issues\": [\"stringa\", \"...\"],\n'
-            '      \"recommendations\": [\"stringa\", \"...\"]\n'
-            "    }\n"
-            "  ],\n"
-            '  \"rerun_suggestions\": [\n'
-            "    {\n"
-            '      \"agent_name\": \"string\",\n'
-            '      \"reason\": \"perché vale la pena rifare il run\",\n'
-            '      \"suggested_params\": {\"chiave\": \"valore\"}\n'
-            "    }\n"
-            "  ],\n"
-            '  \"governance_suggestions\": [\n'
-            "    {\n"
-            '      \"agent_name\": \"string\",\n'
-            '      \"action\": \"promote|demote|keep\",\n'
-            '      \"target_state\": \"draft|test|active|deprecated|null\",\n'
-            '      \"confidence\": 0.0,\n'
-            '      \"reason\": \"spiega brevemente il perché\"\n'
-            "    }\n"
-            "  ],\n"
-            '  \"user_visible_message\": \"testo leggibile per l\\\'utente finale\"\n'
-            "}\n\n"
-            "REGOLE DI GOVERNANCE:\n"
-            "- Sii molto cauto nel proporre 'deprecated': usalo solo per agent con fallimenti gravi/ricorrenti o segnalati da security_review.\n"
-            "- Se non hai abbastanza informazioni per un agent, usa action=\"keep\" e target_state=null.\n"
-            "- Non cambiare lo stato di agent che non compaiono né nei piani né nei run recenti.\n\n"
-            f"{detail_instruction}\n"
-            "Se non hai abbastanza informazioni per alcune sezioni, lasciale vuote."
+        system_prompt = CRITIC_SYSTEM_PROMPT_TEMPLATE.format(
+            detail_instruction=detail_instruction
         )
 
-        messages = [
-            Message(
-                role=MessageRole.USER,
-                content=json.dumps(llm_input, ensure_ascii=False),
-            )
+        messages_list = [
+            [
+                Message(
+                    role=MessageRole.USER,
+                    content=json_dumps(llm_input),
+                )
+            ]
+            for llm_input in llm_inputs
         ]
 
         try:
-            llm_raw = llm.generate(
-                system_prompt=system_prompt,
-                messages=messages,
-                max_tokens=900,
-            )
+            if batch_mode:
+                llm_raws = llm.generate_batch(
+                    system_prompt=system_prompt,
+                    messages_list=messages_list,
+                    max_tokens=900,
+                )
+            else:
+                llm_raws = [
+                    llm.generate(
+                        system_prompt=system_prompt,
+                        messages=messages_list[0],
+                        max_tokens=900,
+                    )
+                ]
         except Exception as exc:  # noqa: BLE001
             msg = f"CriticAgent: errore durante la chiamata all'LLM: {exc}"
             return AgentResult(
@@ -436,13 +503,27 @@ class CriticAgent(Agent):
                 emotion_delta=EmotionDelta(frustration=0.05, confidence=-0.05),
             )
 
-        parsed = _safe_json_loads(llm_raw) or {}
-        summary = str(parsed.get("summary") or "Review tecnica degli ultimi run completata.")
-        user_msg = parsed.get("user_visible_message") or summary
-
-        quality_assessment = parsed.get("quality_assessment") or []
-        rerun_suggestions = parsed.get("rerun_suggestions") or []
-        governance_suggestions = parsed.get("governance_suggestions") or []
+        parsed_list = [safe_json_loads(raw) or {} for raw in llm_raws]
+
+        summaries: List[str] = []
+        user_msgs: List[str] = []
+        quality_assessment: List[Any] = []
+        rerun_suggestions: List[Any] = []
+        governance_suggestions: List[Any] = []
+        for parsed in parsed_list:
+            part_summary = str(parsed.get("summary") or "Review tecnica degli ultimi run completata.")
+            summaries.append(part_summary)
+            user_msgs.append(parsed.get("user_visible_message") or part_summary)
+            quality_assessment.extend(parsed.get("quality_assessment") or [])
+            rerun_suggestions.extend(parsed.get("rerun_suggestions") or [])
+            governance_suggestions.extend(parsed.get("governance_suggestions") or [])
+
+        if batch_mode:
+            summary = "\n".join(f"{name}: {part}" for name, part in zip(reviewed, summaries))
+            user_msg = "\n\n".join(f"[{name}]\n{part}" for name, part in zip(reviewed, user_msgs))
+        else:
+            summary = summaries[0]
+            user_msg = user_msgs[0]
 
         # ------------------------------------------------------------------
         # Scrittura feedback in memorie:
@@ -462,6 +543,7 @@ class CriticAgent(Agent):
                     "severity": "info",
                     "kind": "critic_review",
                     "target_agent": target_agent,
+                    "target_agents": reviewed if batch_mode else None,
                     "has_rerun_suggestions": bool(rerun_suggestions),
                     "has_governance_suggestions": bool(governance_suggestions),
                 },
@@ -471,7 +553,7 @@ class CriticAgent(Agent):
             diagnostic_memory_id = None
 
         # scope progetto (se esiste un project_id nel contesto)
-        project_id = getattr(context, "project_id", None) or getattr(context, "current_project_id", None)
+        project_id = context.project_id
         if project_id:
             try:
                 item2 = memory.store_item(
@@ -1,22 +1,41 @@
 # curator_agent.py — versione 2.0
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
 
 from core.agents_base import Agent, AgentResult
 from core.models import (
+    AgentRunStatus,
     EmotionalState,
     EmotionDelta,
     ConversationContext,
+    MemoryItem,
     MemoryScope,
     MemoryType
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+from core.json_utils import json_loads
 
 LIFECYCLE_STATES = ("draft", "test", "active", "deprecated")
 
+# stato successivo a una promozione ("promote" del CriticAgent)
+PROMOTION_TABLE = {
+    "draft": "test",
+    "test": "active",
+    "active": "active",
+    "deprecated": "test",
+}
+
+# soglie dell'auto-policy sulle metriche di DiagnosticsAgent
+METRIC_PROMOTE_SUCCESS_RATE = 0.85
+METRIC_DEPRECATE_FAILURE_RATE = 0.45
+
+# key delle memorie lette a ogni run (una sola query, vedi _load_governance_items)
+GOVERNANCE_KEYS = ("critic_suggestion", "security_alert", "agent_metrics")
+
 
 class CuratorAgent(Agent):
     """
@@ -45,79 +64,143 @@ class CuratorAgent(Agent):
             return "draft"
         return st
 
-    def _save(self, memory: MemoryEngine, d: Dict[str, Any]):
-        """Wrapper safe per save_agent_definition."""
+    def _item_payload(self, item: MemoryItem) -> Dict[str, Any]:
+        """Contenuto JSON di un MemoryItem come dict ({} se non è un oggetto JSON)."""
+        content = item.content
+        if isinstance(content, dict):
+            return content
         try:
-            memory.save_agent_definition(d)
+            obj = json_loads(content)
         except Exception:
-            pass
+            return {}
+        return obj if isinstance(obj, dict) else {}
+
+    def _index_by_agent(self, items: List[MemoryItem]) -> Dict[Any, List[Dict[str, Any]]]:
+        """Raggruppa i payload degli item per campo "agent" (ordine originale)."""
+        by_agent: Dict[Any, List[Dict[str, Any]]] = {}
+        for item in items:
+            payload = self._item_payload(item)
+            by_agent.setdefault(payload.get("agent"), []).append(payload)
+        return by_agent
 
-    def _load_suggestions(self, memory: MemoryEngine) -> List[Dict[str, Any]]:
+    def _save(self, pending_saves: Dict[str, Dict[str, Any]], d: Dict[str, Any]):
+        """Accoda la definizione da salvare (per id: vince l'ultima modifica), vedi _flush."""
+        pending_saves[d["id"]] = d
+
+    def _load_governance_items(self, memory: MemoryEngine) -> Dict[str, List[MemoryItem]]:
         """
-        Carica eventuali suggerimenti del CriticAgent:
-        scope=GLOBAL / PROJECT
-        type=PROCEDURAL
-        key="critic_suggestion"
+        Carica con una sola query (scope GLOBAL / PROJECT, type PROCEDURAL):
+        - "critic_suggestion": suggerimenti del CriticAgent
+        - "security_alert": alert di SecurityReview
+        - "agent_metrics": metriche di DiagnosticsAgent
+        Gli errori del DB (sqlite3.Error) non vengono nascosti: li gestisce _run_impl.
         """
-        try:
-            return memory.find_items_by_key("critic_suggestion")
-        except Exception:
-            return []
+        return memory.find_items_by_keys(list(GOVERNANCE_KEYS))
 
-    def _load_security_alerts(self, memory: MemoryEngine) -> List[Dict[str, Any]]:
-        try:
-            return memory.find_items_by_key("security_alert")
-        except Exception:
-            return []
+    def _memory_error(self, exc: Exception, msg: str) -> AgentResult:
+        """Risultato di fallimento quando il backend di memoria non risponde."""
+        return AgentResult(
+            output_payload={
+                "user_visible_message": f"{msg} (errore memoria: {exc})",
+                "error": str(exc),
+                "stop_for_user_input": False,
+            },
+            emotion_delta=EmotionDelta(frustration=0.03, confidence=-0.02),
+            status=AgentRunStatus.FAILURE,
+        )
 
-    def _load_diagnostics(self, memory: MemoryEngine) -> Dict[str, Dict[str, float]]:
+    def _load_diagnostics(self, items: List[MemoryItem]) -> Dict[str, Tuple[bool, bool]]:
         """
-        Recupera metriche diagnostiche:
-        {
-          "agent_name": { "success_rate": 0.9, "failure_rate": 0.1, "avg_time": 1.2 }
-        }
+        Legge le metriche diagnostiche dagli item "agent_metrics"
+        ({"agent_name": ..., "success_rate": 0.9, "failure_rate": 0.1, ...})
+        e applica subito le soglie, in un solo passaggio:
+        {agent_name: (sopra soglia di successo, sopra soglia di fallimento)}.
+        Per ogni agent conta la metrica più recente (gli item arrivano dal
+        più recente).
         """
-        try:
-            items = memory.find_items_by_key("agent_metrics")
-        except Exception:
-            return {}
-
-        metrics = {}
+        flags: Dict[str, Tuple[bool, bool]] = {}
         for item in items:
-            try:
-                obj = item.as_dict()
-                ag = obj.get("agent_name")
-                if ag:
-                    metrics[ag] = obj
-            except Exception:
+            obj = self._item_payload(item)
+            ag = obj.get("agent_name")
+            if not ag or ag in flags:
                 continue
-        return metrics
+            succ = obj.get("success_rate")
+            fail = obj.get("failure_rate")
+            flags[ag] = (
+                isinstance(succ, (int, float)) and succ > METRIC_PROMOTE_SUCCESS_RATE,
+                isinstance(fail, (int, float)) and fail > METRIC_DEPRECATE_FAILURE_RATE,
+            )
+        return flags
 
     def _append_genealogy(
         self,
-        memory: MemoryEngine,
+        pending_genealogy: List[Dict[str, Any]],
         agent_name: str,
         parent: Optional[str],
         version: Optional[str],
-        reason: str
+        reason: str,
+        timestamp: str
     ):
-        """Registra genealogia versioni."""
+        """Accoda un record di genealogia versioni, vedi _flush."""
         record = {
             "agent": agent_name,
             "parent": parent,
             "version": version,
             "reason": reason,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": timestamp
         }
+        pending_genealogy.append(record)
+
+    def _flush(
+        self,
+        memory: MemoryEngine,
+        pending_saves: Dict[str, Dict[str, Any]],
+        pending_genealogy: List[Dict[str, Any]]
+    ) -> Optional[sqlite3.Error]:
+        """
+        Scrive in blocco definizioni modificate e genealogia (una transazione
+        ciascuna). Al primo errore del DB si ferma e lo restituisce.
+        """
         try:
-            memory.store_item(
+            memory.save_agent_definitions(list(pending_saves.values()))
+            memory.store_items(
                 scope=MemoryScope.GLOBAL,
                 type_=MemoryType.PROCEDURAL,
                 key="genealogy_record",
-                content=record
+                contents=pending_genealogy
             )
-        except Exception:
-            pass
+        except sqlite3.Error as exc:
+            return exc
+        return None
+
+    def _report(self, promotion_applied: List[Any], demotion_applied: List[Any]) -> AgentResult:
+        """Riepilogo leggibile delle modifiche al ciclo di vita applicate nel run."""
+        lines = ["CuratorAgent — Risultati di governance:\n"]
+
+        if promotion_applied:
+            lines.append("PROMOZIONI:")
+            for n, ns, reason in promotion_applied:
+                lines.append(f"- {n} → {ns} (motivo: {reason})")
+            lines.append("")
+
+        if demotion_applied:
+            lines.append("DEPRECATIONS:")
+            for n, reason in demotion_applied:
+                lines.append(f"- {n} → deprecated (motivo: {reason})")
+            lines.append("")
+
+        if not promotion_applied and not demotion_applied:
+            lines.append("Nessuna modifica al ciclo di vita degli agent.")
+
+        output = {
+            "user_visible_message": "\n".join(lines),
+            "stop_for_user_input": False
+        }
+
+        return AgentResult(
+            output_payload=output,
+            emotion_delta=EmotionDelta(confidence=0.05)
+        )
 
     # -----------------------------------------------------------
     # Core logic
@@ -136,116 +219,105 @@ class CuratorAgent(Agent):
         if not hasattr(memory, "list_agent_definitions"):
             return AgentResult({"user_visible_message": "Agent definitions non disponibili."})
 
-        defs = memory.list_agent_definitions()
+        # Se la memoria non risponde ci fermiamo subito: senza dati ogni
+        # decisione (e ogni scrittura successiva) sarebbe lavoro sprecato
+        try:
+            defs = memory.list_agent_definitions()
+        except sqlite3.Error as exc:
+            return self._memory_error(exc, "CuratorAgent: impossibile leggere le agent definitions.")
         if not defs:
             return AgentResult({"user_visible_message": "Nessun agent registrato."})
 
-        # 2. Carica suggerimenti CriticAgent
-        suggestions = self._load_suggestions(memory)
-
-        # 3. Carica metriche diagnostiche
-        metrics = self._load_diagnostics(memory)
-
-        # 4. Carica alert sicurezza
-        alerts = self._load_security_alerts(memory)
+        # 2-4. Suggerimenti CriticAgent, metriche diagnostiche e alert
+        #      sicurezza, in un'unica lettura della memoria
+        try:
+            governance_items = self._load_governance_items(memory)
+        except sqlite3.Error as exc:
+            return self._memory_error(exc, "CuratorAgent: impossibile leggere suggerimenti, alert e metriche.")
+        suggestions = governance_items["critic_suggestion"]
+        metric_flags = self._load_diagnostics(governance_items["agent_metrics"])
+        alerts = governance_items["security_alert"]
+
+        # indici per agent: ogni definizione guarda solo i propri alert e
+        # suggerimenti, invece di scorrerli tutti
+        alerts_by_agent = self._index_by_agent(alerts)
+        suggestions_by_agent = self._index_by_agent(suggestions)
+
+        # nessun segnale riguarda agent registrati → niente da decidere
+        names = {d.get("name") for d in defs}
+        if (
+            names.isdisjoint(alerts_by_agent)
+            and names.isdisjoint(suggestions_by_agent)
+            and names.isdisjoint(metric_flags)
+        ):
+            return self._report([], [])
 
         # 5. Policy decisioni
         promotion_applied = []
         demotion_applied = []
+        pending_saves: Dict[str, Dict[str, Any]] = {}
+        pending_genealogy: List[Dict[str, Any]] = []
+        # un solo timestamp per tutti i record di genealogia di questo run
+        run_ts = datetime.now(timezone.utc).isoformat()
 
         for d in defs:
             name = d.get("name")
             state = self._get_agent_state(d)
 
             # ---- (A) Sicurezza ha priorità: deprecazione immediata ----
-            for al in alerts:
-                if al.content.get("agent") == name:
-                    d["lifecycle_state"] = "deprecated"
-                    self._save(memory, d)
-                    demotion_applied.append((name, "security_violation"))
-                    self._append_genealogy(memory, name, parent=name, version=d.get("version"), reason="security_violation")
-                    continue
+            for _al in alerts_by_agent.get(name, ()):
+                d["lifecycle_state"] = "deprecated"
+                self._save(pending_saves, d)
+                demotion_applied.append((name, "security_violation"))
+                self._append_genealogy(pending_genealogy, name, parent=name, version=d.get("version"), reason="security_violation", timestamp=run_ts)
 
             # ---- (B) CriticAgent può suggerire promozioni / deprecazioni ----
-            for sug in suggestions:
-                c = sug.content
-                if c.get("agent") != name:
-                    continue
-
+            for c in suggestions_by_agent.get(name, ()):
                 action = c.get("action")
                 reason = c.get("reason", "")
 
                 # Degradazione
                 if action == "deprecate":
                     d["lifecycle_state"] = "deprecated"
-                    self._save(memory, d)
+                    self._save(pending_saves, d)
                     demotion_applied.append((name, reason))
-                    self._append_genealogy(memory, name, parent=name, version=d.get("version"), reason=reason)
+                    self._append_genealogy(pending_genealogy, name, parent=name, version=d.get("version"), reason=reason, timestamp=run_ts)
                     continue
 
                 # Promozione
                 if action == "promote":
                     old_state = self._get_agent_state(d)
-                    new_state = {
-                        "draft": "test",
-                        "test": "active",
-                        "active": "active",
-                        "deprecated": "test"
-                    }[old_state]
+                    new_state = PROMOTION_TABLE[old_state]
 
                     d["lifecycle_state"] = new_state
-                    self._save(memory, d)
+                    self._save(pending_saves, d)
                     promotion_applied.append((name, new_state, reason))
-                    self._append_genealogy(memory, name, parent=name, version=d.get("version"), reason=reason)
+                    self._append_genealogy(pending_genealogy, name, parent=name, version=d.get("version"), reason=reason, timestamp=run_ts)
                     continue
 
             # ---- (C) Auto-policy basata su metriche diagnostiche ----
-            m = metrics.get(name)
-            if m:
-                fail = m.get("failure_rate")
-                succ = m.get("success_rate")
+            flags = metric_flags.get(name)
+            if flags:
+                reliable, failing = flags
 
                 # se è molto affidabile → promuovi fino a "active"
-                if succ is not None and succ > 0.85 and state in ("draft", "test"):
+                if reliable and state in ("draft", "test"):
                     d["lifecycle_state"] = "active"
-                    self._save(memory, d)
+                    self._save(pending_saves, d)
                     promotion_applied.append((name, "active", "metrics_success"))
-                    self._append_genealogy(memory, name, parent=name, version=d.get("version"), reason="metric_success")
+                    self._append_genealogy(pending_genealogy, name, parent=name, version=d.get("version"), reason="metric_success", timestamp=run_ts)
 
                 # se fallisce troppo → deprecazione
-                if fail is not None and fail > 0.45 and state != "deprecated":
+                if failing and state != "deprecated":
                     d["lifecycle_state"] = "deprecated"
-                    self._save(memory, d)
+                    self._save(pending_saves, d)
                     demotion_applied.append((name, "high_failure"))
-                    self._append_genealogy(memory, name, parent=name, version=d.get("version"), reason="metric_failure")
-
-        # -----------------------------------------------------------
-        # Output
-        # -----------------------------------------------------------
-
-        lines = ["CuratorAgent — Risultati di governance:\n"]
-
-        if promotion_applied:
-            lines.append("PROMOZIONI:")
-            for n, ns, reason in promotion_applied:
-                lines.append(f"- {n} → {ns} (motivo: {reason})")
-            lines.append("")
-
-        if demotion_applied:
-            lines.append("DEPRECATIONS:")
-            for n, reason in demotion_applied:
-                lines.append(f"- {n} → deprecated (motivo: {reason})")
-            lines.append("")
-
-        if not promotion_applied and not demotion_applied:
-            lines.append("Nessuna modifica al ciclo di vita degli agent.")
+                    self._append_genealogy(pending_genealogy, name, parent=name, version=d.get("version"), reason="metric_failure", timestamp=run_ts)
 
-        output = {
-            "user_visible_message": "\n".join(lines),
-            "stop_for_user_input": False
-        }
+        flush_error = self._flush(memory, pending_saves, pending_genealogy)
+        if flush_error is not None:
+            return self._memory_error(
+                flush_error, "CuratorAgent: decisioni di governance calcolate ma non salvate."
+            )
 
-        return AgentResult(
-            output_payload=output,
-            emotion_delta=EmotionDelta(confidence=0.05)
-        )
+        return self._report(promotion_applied, demotion_applied)
@@ -17,6 +17,8 @@ from core.models import (
 )
 from core.memory import MemoryEngine
 from core.llm_provider import LLMProvider
+# La scheda viene cacheata per l'AnalysisPlannerAgent: la invalidiamo a ogni scrittura
+from core.sheet_cache import invalidate_requirements_sheet_cache
 
 
 def _safe_json_loads(raw: str) -> Optional[dict]:
@@ -237,6 +239,7 @@ class RequirementsAgent(Agent):
                 content=json.dumps(requirements_sheet, ensure_ascii=False),
                 metadata={"agent": self.name},
             )
+            invalidate_requirements_sheet_cache(key_conv)
         except Exception:
             pass
 
@@ -251,6 +254,7 @@ class RequirementsAgent(Agent):
                     content=json.dumps(requirements_sheet, ensure_ascii=False),
                     metadata={"agent": self.name, "project_id": project_id},
                 )
+                invalidate_requirements_sheet_cache(key_proj)
             except Exception:
                 pass
 
@@ -3,14 +3,14 @@ from __future__ import annotations
 import importlib
 import inspect
 import pkgutil
-from typing import List
+from typing import Sequence
 
 from .agents_base import Agent, AgentRegistry
 
 
 def load_agents_from_packages(
     registry: AgentRegistry,
-    package_names: List[str],
+    package_names: Sequence[str],
 ) -> None:
     """
     Scansiona i package indicati (es. ["agents", "r_agents"]),
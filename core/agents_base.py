@@ -16,7 +16,7 @@ from .memory import MemoryEngine
 from .llm_provider import LLMProvider
 
 
-@dataclass
+@dataclass(slots=True)
 class AgentResult:
     output_payload: Dict[str, Any]
     emotion_delta: EmotionDelta = field(default_factory=EmotionDelta)
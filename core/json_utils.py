@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Optional
+
+try:  # orjson è opzionale: (de)serializzazione in C, molto più veloce del json stdlib
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+def json_loads(raw: Any) -> Any:
+    """
+    Parsing JSON (str o bytes). Usa orjson se disponibile, altrimenti json.
+    Solleva ValueError (json.JSONDecodeError / orjson.JSONDecodeError) se non valido.
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def safe_json_loads(raw: Any) -> Optional[dict]:
+    """
+    Estrae un oggetto JSON dalla risposta di un LLM:
+    - prova json_loads diretto (orjson se disponibile),
+    - se fallisce, decodifica il primo oggetto {...} valido immerso nel testo
+      (raw_decode si ferma a fine oggetto: niente snippet intermedi, e testo o
+      altri blocchi dopo il JSON non danno fastidio).
+    Ritorna None se non c'è nessun oggetto valido.
+    """
+    try:
+        val = json_loads(raw)
+        if isinstance(val, dict):
+            return val
+    except Exception:
+        pass
+
+    if not isinstance(raw, str):
+        return None
+
+    start = raw.find("{")
+    while start != -1:
+        try:
+            val2, _ = _JSON_DECODER.raw_decode(raw, start)
+            if isinstance(val2, dict):
+                return val2
+        except ValueError:
+            pass
+        start = raw.find("{", start + 1)
+
+    return None
+
+
+def json_dumps(obj: Any) -> str:
+    """
+    Serializza in JSON compatto UTF-8 (equivalente a ensure_ascii=False).
+    Se orjson non supporta l'oggetto (es. chiavi non stringa) ripiega su json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def json_dumps_prefix(obj: Any, limit: int) -> str:
+    """
+    Primi `limit` caratteri di json_dumps(obj), per snippet di anteprima.
+    Con orjson decodifica solo i byte che servono (al più 4 per carattere
+    UTF-8) invece di convertire in str l'intero JSON.
+    """
+    if orjson is not None:
+        try:
+            head = orjson.dumps(obj)[: limit * 4]
+        except TypeError:
+            pass
+        else:
+            # un carattere multibyte tagliato in coda viene scartato
+            return head.decode("utf-8", errors="ignore")[:limit]
+    return json_dumps(obj)[:limit]
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from typing import Any, Callable, List, Optional
+
+from .models import Message
+from .memory import MemoryEngine
+from .llm_provider import LLMProvider, prompt_key
+
+
+# le risposte salvate scadono dopo una settimana; oltre questo numero di righe
+# vengono scartate le meno recenti (potatura a ogni salvataggio)
+LLM_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 5000
+
+
+class LLMResponseCache:
+    """
+    Cache esatta prompt -> risposta per le chiamate LLM degli agent.
+
+    La chiave è "<namespace>:" + hash blake2b di (system_prompt, messages,
+    kwargs di generazione): richieste identiche riusano la risposta salvata
+    e saltano la chiamata di rete.
+    Le risposte sono persistite nella tabella llm_cache del MemoryEngine,
+    quindi sopravvivono ai riavvii, ma scadono dopo `max_age_seconds` e la
+    tabella non supera `max_entries` righe.
+    """
+
+    def __init__(
+        self,
+        memory: MemoryEngine,
+        namespace: str = "llm",
+        max_age_seconds: Optional[float] = LLM_CACHE_MAX_AGE_SECONDS,
+        max_entries: Optional[int] = LLM_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.memory = memory
+        self.namespace = namespace
+        self.max_age_seconds = max_age_seconds
+        self.max_entries = max_entries
+        # memorie "finte" (test, mock) possono non avere la tabella di cache
+        self.enabled = hasattr(memory, "load_cached_llm_response") and hasattr(
+            memory, "save_cached_llm_response"
+        )
+
+    def make_key(self, system_prompt: str, messages: List[Message], **kwargs: Any) -> str:
+        return f"{self.namespace}:{prompt_key(system_prompt, messages, **kwargs)}"
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            return self.memory.load_cached_llm_response(
+                key, max_age_seconds=self.max_age_seconds
+            )
+        except Exception:  # noqa: BLE001
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.memory.save_cached_llm_response(
+                key,
+                response,
+                max_age_seconds=self.max_age_seconds,
+                max_entries=self.max_entries,
+            )
+        except Exception:  # noqa: BLE001
+            pass
+
+    def generate(
+        self,
+        llm: LLMProvider,
+        system_prompt: str,
+        messages: List[Message],
+        should_cache: Optional[Callable[[str], bool]] = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Come llm.generate(...), ma passa prima dalla cache.
+        Le eccezioni dell'LLM non vengono intercettate (e nulla viene cacheato).
+        `should_cache` permette di non salvare risposte inutilizzabili
+        (es. JSON non valido), così una nuova richiesta potrà riprovare.
+        """
+        key = self.make_key(system_prompt, messages, **kwargs)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        raw = llm.generate(system_prompt=system_prompt, messages=messages, **kwargs)
+        if isinstance(raw, str) and raw and (should_cache is None or should_cache(raw)):
+            self.put(key, raw)
+        return raw
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
 import os
 
 from .models import Message, MessageRole
@@ -17,9 +20,97 @@ class LLMProvider(ABC):
         """
         Ritorna il testo generato dall'LLM come stringa.
         `messages` è una lista di Message (role, content).
+        I kwargs (max_tokens, response_format, ...) sono inoltrati al backend
+        così come sono; i provider che non li supportano li ignorano.
         """
         raise NotImplementedError
 
+    def generate_batch(
+        self,
+        system_prompt: str,
+        messages_list: List[List[Message]],
+        **kwargs,
+    ) -> List[str]:
+        """
+        Più richieste con lo stesso system prompt in una sola chiamata:
+        ritorna una risposta per ciascuna lista di messaggi, nello stesso ordine.
+        Di default le richieste partono in parallelo su generate(); i provider
+        con un endpoint batch nativo possono ridefinirlo.
+        Richieste identiche nello stesso batch (stessa prompt_key) partono una
+        volta sola e condividono la risposta.
+        Se una richiesta fallisce, l'eccezione viene propagata.
+        """
+        # posizione nel batch → indice della richiesta unica che la serve
+        unique: List[List[Message]] = []
+        slot_by_key: Dict[str, int] = {}
+        slots: List[int] = []
+        for msgs in messages_list:
+            key = prompt_key(system_prompt, msgs, **kwargs)
+            slot = slot_by_key.get(key)
+            if slot is None:
+                slot = slot_by_key[key] = len(unique)
+                unique.append(msgs)
+            slots.append(slot)
+
+        if len(unique) <= 1:
+            replies = [self.generate(system_prompt, msgs, **kwargs) for msgs in unique]
+        else:
+            workers = min(LLM_BATCH_MAX_WORKERS, len(unique))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                replies = list(
+                    pool.map(
+                        lambda msgs: self.generate(system_prompt, msgs, **kwargs),
+                        unique,
+                    )
+                )
+        return [replies[slot] for slot in slots]
+
+
+# richieste contemporanee al backend in generate_batch (default)
+LLM_BATCH_MAX_WORKERS = 8
+
+
+def prompt_key(system_prompt: str, messages: List[Message], **kwargs: Any) -> str:
+    """
+    Hash stabile (blake2b, 128 bit) di una richiesta LLM: system prompt, messaggi
+    e kwargs di generazione. Usato dalla cache delle risposte e per unire le
+    richieste identiche di generate_batch.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(system_prompt.encode("utf-8"))
+    for m in messages:
+        h.update(b"\x00")
+        h.update(m.role.value.encode("utf-8"))
+        h.update(b"\x00")
+        h.update(m.content.encode("utf-8"))
+    if kwargs:
+        h.update(b"\x00")
+        h.update(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+# Pool HTTP condiviso da tutte le chiamate di un provider: connessioni keep-alive
+# riusate tra Architect → Validator → Critic (niente handshake TCP/TLS a ogni generate)
+LLM_HTTP_TIMEOUT = 60.0
+LLM_MAX_KEEPALIVE_CONNECTIONS = 32
+LLM_MAX_CONNECTIONS = 64
+
+
+def _pooled_http_client():
+    """
+    httpx.Client persistente da passare agli SDK Groq/OpenAI (`http_client=`).
+    httpx è già una dipendenza di entrambi gli SDK.
+    """
+    import httpx  # import locale: serve solo con i provider remoti
+
+    return httpx.Client(
+        timeout=LLM_HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            max_connections=LLM_MAX_CONNECTIONS,
+        ),
+    )
+
 
 class SimpleEchoLLM(LLMProvider):
     """
@@ -55,7 +146,10 @@ class OpenAILLM(LLMProvider):
                 "OpenAILLM: manca OPENAI_API_KEY nell'ambiente o api_key nel costruttore."
             )
 
-        self.client = OpenAI(api_key="immettere l'API KEY di OpenAI")
+        self.client = OpenAI(
+            api_key="immettere l'API KEY di OpenAI",
+            http_client=_pooled_http_client(),
+        )
         self.model = model
 
     def generate(self, system_prompt: str, messages: List[Message], **kwargs) -> str:
@@ -102,7 +196,10 @@ class GroqLLM(LLMProvider):
                 "GroqLLM: manca GROQ_API_KEY nell'ambiente o api_key nel costruttore."
             )
 
-        self.client = Groq(api_key="immettere l'API KEY di Groq")
+        self.client = Groq(
+            api_key="immettere l'API KEY di Groq",
+            http_client=_pooled_http_client(),
+        )
         self.model = model
 
     def generate(self, system_prompt: str, messages: List[Message], **kwargs) -> str:
@@ -4,8 +4,8 @@ import json
 import sqlite3
 from dataclasses import dataclass, field
 from enum import Enum
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
 from .models import (
     MemoryItem,
@@ -38,15 +38,25 @@ class MemoryEngine:
     def _get_conn(self) -> sqlite3.Connection:
         return sqlite3.connect(self.db_path)
 
-    def get_recent_agent_runs(self, limit: int = 50) -> List[AgentRun]:
+    def get_recent_agent_runs(
+        self,
+        limit: int = 50,
+        agent_name: Optional[str] = None,
+        newest_first: bool = False,
+    ) -> List[AgentRun]:
         """
-        Ritorna gli ultimi `limit` AgentRun dal DB, in ordine cronologico crescente.
+        Ritorna gli ultimi `limit` AgentRun dal DB (solo quelli di `agent_name`,
+        se indicato), in ordine cronologico crescente; con newest_first=True
+        la stessa finestra viene restituita dal più recente al più vecchio.
         Utile per DiagnosticsAgent, replay, audit, ecc.
         """
+        where = "WHERE agent_name = ?" if agent_name else ""
+        params: Tuple[Any, ...] = (agent_name, limit) if agent_name else (limit,)
+
         conn = self._get_conn()
         cur = conn.cursor()
         cur.execute(
-            """
+            f"""
             SELECT
                 id,
                 agent_name,
@@ -60,10 +70,11 @@ class MemoryEngine:
                 started_at,
                 finished_at
             FROM agent_runs
+            {where}
             ORDER BY started_at DESC
             LIMIT ?
             """,
-            (limit,),
+            params,
         )
         rows = cur.fetchall()
         conn.close()
@@ -100,6 +111,8 @@ class MemoryEngine:
                 )
             )
 
+        if newest_first:
+            return runs
         # Restituiamo dal più vecchio al più nuovo
         return list(reversed(runs))
 
@@ -211,6 +224,18 @@ class MemoryEngine:
                 timestamp TEXT NOT NULL,
                 payload_json TEXT NOT NULL
             );
+
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+
+            -- Contatore di revisione per tabella, aggiornato dai trigger sotto
+            CREATE TABLE IF NOT EXISTS table_revisions (
+                name TEXT PRIMARY KEY,
+                revision INTEGER NOT NULL DEFAULT 0
+            );
             """
         )
 
@@ -222,6 +247,55 @@ class MemoryEngine:
 
             CREATE INDEX IF NOT EXISTS idx_memory_items_scope_type_created
               ON memory_items(scope, type, created_at);
+
+            -- Indici per gli ultimi AgentRun (anche filtrati per agent)
+            CREATE INDEX IF NOT EXISTS idx_agent_runs_started
+              ON agent_runs(started_at);
+
+            CREATE INDEX IF NOT EXISTS idx_agent_runs_agent_started
+              ON agent_runs(agent_name, started_at);
+
+            -- Indice per gli ultimi eventi di un tipo (es. PLAN_CREATED)
+            CREATE INDEX IF NOT EXISTS idx_events_type_timestamp
+              ON events(type, timestamp);
+
+            -- Indice per scadenza/pruning della cache LLM
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_created
+              ON llm_cache(created_at);
+
+            -- Indice per l'ultima AgentDefinition (Validator/Critic)
+            CREATE INDEX IF NOT EXISTS idx_agent_definitions_created
+              ON agent_definitions(created_at);
+            """
+        )
+
+        # Revisione di agent_definitions tenuta dal DB: vede anche le scritture
+        # di altri processi/connessioni (vedi agent_definitions_revision)
+        cur.executescript(
+            """
+            INSERT OR IGNORE INTO table_revisions (name, revision)
+            VALUES ('agent_definitions', 0);
+
+            CREATE TRIGGER IF NOT EXISTS trg_agent_definitions_insert
+            AFTER INSERT ON agent_definitions
+            BEGIN
+                UPDATE table_revisions SET revision = revision + 1
+                WHERE name = 'agent_definitions';
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_agent_definitions_update
+            AFTER UPDATE ON agent_definitions
+            BEGIN
+                UPDATE table_revisions SET revision = revision + 1
+                WHERE name = 'agent_definitions';
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_agent_definitions_delete
+            AFTER DELETE ON agent_definitions
+            BEGIN
+                UPDATE table_revisions SET revision = revision + 1
+                WHERE name = 'agent_definitions';
+            END;
             """
         )
 
@@ -240,13 +314,18 @@ class MemoryEngine:
 
     # ----------------- Memoria items ---------------------------------
 
-    def store_item(
-        self,
+    _INSERT_MEMORY_ITEM_SQL = """
+        INSERT INTO memory_items (id, scope, type, key, content, metadata_json, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+
+    @staticmethod
+    def _new_memory_item(
         scope: MemoryScope,
         type_: MemoryType,
         key: str,
         content: Any,
-        metadata: Optional[Dict[str, Any]] = None,
+        metadata: Optional[Dict[str, Any]],
     ) -> MemoryItem:
         # Normalizza content a stringa
         if isinstance(content, str):
@@ -257,7 +336,7 @@ class MemoryEngine:
             except Exception:
                 content_str = str(content)
 
-        item = MemoryItem(
+        return MemoryItem(
             id=new_id(),
             scope=scope,
             type=type_,
@@ -265,34 +344,76 @@ class MemoryEngine:
             content=content_str,
             metadata=metadata or {},
         )
+
+    @staticmethod
+    def _memory_item_params(item: MemoryItem) -> Tuple[Any, ...]:
+        return (
+            item.id,
+            item.scope.value,
+            item.type.value,
+            item.key,
+            item.content,
+            json.dumps(item.metadata),
+            item.created_at.isoformat(),
+        )
+
+    def store_item(
+        self,
+        scope: MemoryScope,
+        type_: MemoryType,
+        key: str,
+        content: Any,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> MemoryItem:
+        item = self._new_memory_item(scope, type_, key, content, metadata)
         conn = self._get_conn()
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO memory_items (id, scope, type, key, content, metadata_json, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                item.id,
-                item.scope.value,
-                item.type.value,
-                item.key,
-                item.content,
-                json.dumps(item.metadata),
-                item.created_at.isoformat(),
-            ),
-        )
+        cur.execute(self._INSERT_MEMORY_ITEM_SQL, self._memory_item_params(item))
         conn.commit()
         conn.close()
         return item
 
+    def store_items(
+        self,
+        scope: MemoryScope,
+        type_: MemoryType,
+        key: str,
+        contents: List[Any],
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> List[MemoryItem]:
+        """
+        Come store_item, ma per più contenuti con gli stessi scope/type/key
+        in un'unica transazione (una sola connessione e un solo commit).
+        """
+        items = [
+            self._new_memory_item(scope, type_, key, content, metadata)
+            for content in contents
+        ]
+        if not items:
+            return items
+        conn = self._get_conn()
+        cur = conn.cursor()
+        cur.executemany(
+            self._INSERT_MEMORY_ITEM_SQL,
+            [self._memory_item_params(item) for item in items],
+        )
+        conn.commit()
+        conn.close()
+        return items
+
     def search_items(
         self,
         scope: Optional[MemoryScope] = None,
         type_: Optional[MemoryType] = None,
         query: Optional[str] = None,
         limit: int = 10,
+        oldest_first: bool = False,
     ) -> List[MemoryItem]:
+        """
+        Ritorna gli ultimi `limit` MemoryItem che rispettano i filtri,
+        dal più recente al più vecchio; con oldest_first=True la stessa
+        finestra viene restituita in ordine cronologico crescente.
+        """
         sql = """
             SELECT id, scope, type, key, content, metadata_json, created_at
             FROM memory_items
@@ -316,6 +437,10 @@ class MemoryEngine:
         sql += " ORDER BY created_at DESC LIMIT ?"
         params.append(limit)
 
+        if oldest_first:
+            # la finestra resta "gli ultimi N", ordinata però dal più vecchio
+            sql = f"SELECT * FROM ({sql}) ORDER BY created_at ASC"
+
         conn = self._get_conn()
         cur = conn.cursor()
         cur.execute(sql, params)
@@ -418,12 +543,26 @@ class MemoryEngine:
         Utile per agent che vogliono recuperare velocemente
         un risultato precedente (es. r_eda_result, r_modeling_result, ecc.).
         """
-        sql = """
-            SELECT content
-            FROM memory_items
+        return self.load_items_content_batch([(key, scope, type_)])[0]
+
+    def find_items_by_keys(
+        self,
+        keys: List[str],
+        scope: Optional[MemoryScope] = None,
+        type_: Optional[MemoryType] = None,
+        limit: int = 50,
+    ) -> Dict[str, List[MemoryItem]]:
         """
-        clauses: List[str] = ["key = ?"]
-        params: List[Any] = [key]
+        Variante batch di find_items_by_key: una sola query per più key.
+        Ritorna {key: ultimi `limit` MemoryItem con quella key}, dal più
+        recente al più vecchio; ogni key richiesta è presente (anche vuota).
+        """
+        result: Dict[str, List[MemoryItem]] = {k: [] for k in keys}
+        if not result:
+            return result
+
+        clauses: List[str] = [f"key IN ({', '.join('?' * len(result))})"]
+        params: List[Any] = list(result)
 
         if scope is not None:
             clauses.append("scope = ?")
@@ -432,18 +571,87 @@ class MemoryEngine:
             clauses.append("type = ?")
             params.append(type_.value)
 
-        sql += " WHERE " + " AND ".join(clauses)
-        sql += " ORDER BY created_at DESC LIMIT 1"
+        # il limite vale per key: numeriamo le righe dentro ogni key
+        sql = f"""
+            SELECT id, scope, type, key, content, metadata_json, created_at
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY key ORDER BY created_at DESC
+                ) AS rn
+                FROM memory_items
+                WHERE {" AND ".join(clauses)}
+            )
+            WHERE rn <= ?
+            ORDER BY created_at DESC
+        """
+        params.append(limit)
 
         conn = self._get_conn()
         cur = conn.cursor()
         cur.execute(sql, params)
-        row = cur.fetchone()
+        rows = cur.fetchall()
         conn.close()
 
-        if row is None:
-            return None
-        return row[0]
+        for (
+            item_id,
+            scope_str,
+            type_str,
+            key,
+            content,
+            metadata_json,
+            created_at_str,
+        ) in rows:
+            result[key].append(
+                MemoryItem(
+                    id=item_id,
+                    scope=MemoryScope(scope_str),
+                    type=MemoryType(type_str),
+                    key=key,
+                    content=content,
+                    metadata=json.loads(metadata_json),
+                    created_at=datetime.fromisoformat(created_at_str),
+                )
+            )
+        return result
+
+    def load_items_content_batch(
+        self,
+        lookups: List[Tuple[str, Optional[MemoryScope], Optional[MemoryType]]],
+    ) -> List[Optional[str]]:
+        """
+        Variante batch di load_item_content: per ogni (key, scope, type_)
+        ritorna il contenuto dell'ultimo MemoryItem corrispondente (o None),
+        nello stesso ordine di `lookups`, usando una sola connessione.
+        """
+        results: List[Optional[str]] = []
+        if not lookups:
+            return results
+
+        conn = self._get_conn()
+        cur = conn.cursor()
+        for key, scope, type_ in lookups:
+            sql = """
+                SELECT content
+                FROM memory_items
+            """
+            clauses: List[str] = ["key = ?"]
+            params: List[Any] = [key]
+
+            if scope is not None:
+                clauses.append("scope = ?")
+                params.append(scope.value)
+            if type_ is not None:
+                clauses.append("type = ?")
+                params.append(type_.value)
+
+            sql += " WHERE " + " AND ".join(clauses)
+            sql += " ORDER BY created_at DESC LIMIT 1"
+
+            cur.execute(sql, params)
+            row = cur.fetchone()
+            results.append(None if row is None else row[0])
+        conn.close()
+        return results
 
     def load_user_profile_json(self, user_id: str) -> Optional[str]:
         """
@@ -583,6 +791,37 @@ class MemoryEngine:
 
     # ----------------- Definizioni di agent --------------------------
 
+    _UPSERT_AGENT_DEFINITION_SQL = """
+        INSERT INTO agent_definitions (
+            id, name, description, config_json, created_at,
+            is_active, parent_id, lifecycle_state
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            name = excluded.name,
+            description = excluded.description,
+            config_json = excluded.config_json,
+            is_active = excluded.is_active,
+            parent_id = excluded.parent_id,
+            lifecycle_state = excluded.lifecycle_state
+    """
+
+    @staticmethod
+    def _agent_definition_params(definition: Dict[str, Any]) -> Tuple[Any, ...]:
+        config = definition.get("config", {})
+        created_at = definition.get("created_at", datetime.utcnow())
+        lifecycle_state = definition.get("lifecycle_state", "draft") or "draft"
+        return (
+            definition["id"],
+            definition["name"],
+            definition.get("description", ""),
+            json.dumps(config),
+            created_at.isoformat(),
+            1 if definition.get("is_active", False) else 0,
+            definition.get("parent_id"),
+            lifecycle_state,
+        )
+
     def save_agent_definition(self, definition: Dict[str, Any]) -> None:
         """
         Salva/aggiorna una AgentDefinition logica (come dict) nel DB.
@@ -597,56 +836,53 @@ class MemoryEngine:
         """
         conn = self._get_conn()
         cur = conn.cursor()
-
-        config = definition.get("config", {})
-        created_at = definition.get("created_at", datetime.utcnow())
-        lifecycle_state = definition.get("lifecycle_state", "draft") or "draft"
-
         cur.execute(
-            """
-            INSERT INTO agent_definitions (
-                id, name, description, config_json, created_at,
-                is_active, parent_id, lifecycle_state
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(id) DO UPDATE SET
-                name = excluded.name,
-                description = excluded.description,
-                config_json = excluded.config_json,
-                is_active = excluded.is_active,
-                parent_id = excluded.parent_id,
-                lifecycle_state = excluded.lifecycle_state
-            """,
-            (
-                definition["id"],
-                definition["name"],
-                definition.get("description", ""),
-                json.dumps(config),
-                created_at.isoformat(),
-                1 if definition.get("is_active", False) else 0,
-                definition.get("parent_id"),
-                lifecycle_state,
-            ),
+            self._UPSERT_AGENT_DEFINITION_SQL,
+            self._agent_definition_params(definition),
         )
         conn.commit()
         conn.close()
 
-    def list_agent_definitions(self) -> List[Dict[str, Any]]:
+    def save_agent_definitions(self, definitions: List[Dict[str, Any]]) -> None:
+        """
+        Come save_agent_definition, ma per più definizioni in un'unica
+        transazione (una sola connessione e un solo commit).
+        """
+        if not definitions:
+            return
+        conn = self._get_conn()
+        cur = conn.cursor()
+        cur.executemany(
+            self._UPSERT_AGENT_DEFINITION_SQL,
+            [self._agent_definition_params(d) for d in definitions],
+        )
+        conn.commit()
+        conn.close()
+
+    def agent_definitions_revision(self) -> int:
+        """
+        Revisione delle agent_definitions, mantenuta da trigger SQLite: cambia
+        a ogni insert/update/delete sulla tabella, da qualunque connessione o
+        processo. Permette agli agent di riusare dati derivati dalle
+        definizioni finché il registro non viene modificato.
+        """
         conn = self._get_conn()
         cur = conn.cursor()
         cur.execute(
-            """
-            SELECT id, name, description, config_json,
-                   created_at, is_active, parent_id, lifecycle_state
-            FROM agent_definitions
-            ORDER BY created_at ASC
-            """
+            "SELECT revision FROM table_revisions WHERE name = 'agent_definitions'"
         )
-        rows = cur.fetchall()
+        row = cur.fetchone()
         conn.close()
+        return int(row[0]) if row else 0
 
-        defs: List[Dict[str, Any]] = []
-        for (
+    _AGENT_DEFINITION_COLUMNS = """
+        id, name, description, config_json,
+        created_at, is_active, parent_id, lifecycle_state
+    """
+
+    @staticmethod
+    def _row_to_agent_definition(row: Tuple[Any, ...]) -> Dict[str, Any]:
+        (
             id_,
             name,
             description,
@@ -655,20 +891,147 @@ class MemoryEngine:
             is_active_int,
             parent_id,
             lifecycle_state,
-        ) in rows:
-            defs.append(
-                {
-                    "id": id_,
-                    "name": name,
-                    "description": description,
-                    "config": json.loads(config_json),
-                    "created_at": datetime.fromisoformat(created_at_str),
-                    "is_active": bool(is_active_int),
-                    "parent_id": parent_id,
-                    "lifecycle_state": lifecycle_state or "draft",
-                }
+        ) = row
+        return {
+            "id": id_,
+            "name": name,
+            "description": description,
+            "config": json.loads(config_json),
+            "created_at": datetime.fromisoformat(created_at_str),
+            "is_active": bool(is_active_int),
+            "parent_id": parent_id,
+            "lifecycle_state": lifecycle_state or "draft",
+        }
+
+    def list_agent_definitions(self) -> List[Dict[str, Any]]:
+        conn = self._get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT {self._AGENT_DEFINITION_COLUMNS}
+            FROM agent_definitions
+            ORDER BY created_at ASC
+            """
+        )
+        rows = cur.fetchall()
+        conn.close()
+
+        return [self._row_to_agent_definition(row) for row in rows]
+
+    def get_agent_definition(self, definition_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Ritorna una singola AgentDefinition per id (lookup sulla primary key),
+        oppure None se non esiste.
+        """
+        conn = self._get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT {self._AGENT_DEFINITION_COLUMNS}
+            FROM agent_definitions
+            WHERE id = ?
+            LIMIT 1
+            """,
+            (definition_id,),
+        )
+        row = cur.fetchone()
+        conn.close()
+
+        if row is None:
+            return None
+        return self._row_to_agent_definition(row)
+
+    def get_latest_agent_definition(self) -> Optional[Dict[str, Any]]:
+        """
+        Ritorna l'AgentDefinition creata per ultima (la stessa che sarebbe
+        list_agent_definitions()[-1]), oppure None se la tabella è vuota.
+        """
+        conn = self._get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT {self._AGENT_DEFINITION_COLUMNS}
+            FROM agent_definitions
+            ORDER BY created_at DESC, rowid DESC
+            LIMIT 1
+            """
+        )
+        row = cur.fetchone()
+        conn.close()
+
+        if row is None:
+            return None
+        return self._row_to_agent_definition(row)
+
+    # ----------------- Cache risposte LLM ----------------------------
+
+    def load_cached_llm_response(
+        self,
+        key: str,
+        max_age_seconds: Optional[float] = None,
+    ) -> Optional[str]:
+        """
+        Ritorna la risposta LLM salvata per `key` (hash del prompt),
+        oppure None se non presente o più vecchia di `max_age_seconds`.
+        Vedi core.llm_cache.LLMResponseCache.
+        """
+        conn = self._get_conn()
+        cur = conn.cursor()
+        cur.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,))
+        row = cur.fetchone()
+        conn.close()
+
+        if row is None:
+            return None
+        response, created_at_str = row
+        if max_age_seconds is not None:
+            age = datetime.utcnow() - datetime.fromisoformat(created_at_str)
+            if age > timedelta(seconds=max_age_seconds):
+                return None
+        return response
+
+    def save_cached_llm_response(
+        self,
+        key: str,
+        response: str,
+        max_age_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        """
+        Salva/sovrascrive la risposta LLM associata a `key`.
+        Nella stessa transazione pota la cache: righe più vecchie di
+        `max_age_seconds` e, oltre `max_entries`, le meno recenti.
+        """
+        now = datetime.utcnow()
+        conn = self._get_conn()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT OR REPLACE INTO llm_cache (key, response, created_at)
+            VALUES (?, ?, ?)
+            """,
+            (key, response, now.isoformat()),
+        )
+        if max_age_seconds is not None:
+            cutoff = now - timedelta(seconds=max_age_seconds)
+            cur.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?",
+                (cutoff.isoformat(),),
+            )
+        if max_entries is not None:
+            cur.execute(
+                """
+                DELETE FROM llm_cache
+                WHERE key IN (
+                    SELECT key FROM llm_cache
+                    ORDER BY created_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (max_entries,),
             )
-        return defs
+        conn.commit()
+        conn.close()
 
     # ----------------- Event log -------------------------------------
 
@@ -713,19 +1076,27 @@ class MemoryEngine:
         self,
         correlation_id: Optional[str] = None,
         limit: int = 200,
+        types: Optional[List[EventType]] = None,
     ) -> List[Event]:
         """
-        Ritorna gli ultimi eventi, opzionalmente filtrati per correlation_id.
+        Ritorna gli ultimi eventi, opzionalmente filtrati per correlation_id
+        e per tipo (`types`: il limite conta solo gli eventi di quei tipi).
         Utile per DiagnosticsAgent, replay, audit.
         """
         sql = """
             SELECT id, type, correlation_id, timestamp, payload_json
             FROM events
         """
+        clauses: List[str] = []
         params: List[Any] = []
         if correlation_id:
-            sql += " WHERE correlation_id = ?"
+            clauses.append("correlation_id = ?")
             params.append(correlation_id)
+        if types:
+            clauses.append(f"type IN ({', '.join('?' * len(types))})")
+            params.extend(EventType(t).value for t in types)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
         sql += " ORDER BY timestamp DESC LIMIT ?"
         params.append(limit)
 
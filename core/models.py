@@ -111,7 +111,7 @@ class Plan:
         return any(task.status == TaskStatus.PENDING for task in self.tasks)
 
 
-@dataclass
+@dataclass(slots=True)
 class EmotionDelta:
     curiosity: float = 0.0
     fatigue: float = 0.0
@@ -231,7 +231,18 @@ class ConversationContext:
     created_at: datetime = field(default_factory=datetime.utcnow)
     updated_at: datetime = field(default_factory=datetime.utcnow)
     correlation_id: Optional[str] = None
-    
+    # progetto corrente (memorie PROJECT); None fuori da un progetto
+    project_id: Optional[str] = None
+
+    @property
+    def current_project_id(self) -> Optional[str]:
+        """Alias storico di project_id (deprecato: usare project_id)."""
+        return self.project_id
+
+    @current_project_id.setter
+    def current_project_id(self, value: Optional[str]) -> None:
+        self.project_id = value
+
     def add_message(self, role: MessageRole, content: str) -> None:
         self.messages.append(Message(role=role, content=content))
         self.updated_at = datetime.utcnow()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .models import MemoryScope, MemoryType
+from .memory import MemoryEngine
+
+
+# ---------------------------------------------------------
+# Cache in-process delle requirements_sheet lette da memoria,
+# condivisa da chi le legge (AnalysisPlannerAgent) e da chi le
+# scrive (RequirementsAgent, che la invalida).
+# Chiave: (db_path, scope, key) -> (timestamp monotonic, contenuto raw).
+# Cacheiamo solo i hit: un miss deve poter vedere subito una scheda
+# appena scritta dal RequirementsAgent.
+# ---------------------------------------------------------
+
+SHEET_CACHE_TTL = 30.0  # secondi
+SHEET_CACHE_MAX_ENTRIES = 256
+_SHEET_CACHE: Dict[Tuple[str, str, str], Tuple[float, str]] = {}
+
+
+def cached_load_many(
+    memory: MemoryEngine,
+    lookups: List[Tuple[MemoryScope, str]],
+) -> List[Optional[str]]:
+    """
+    Carica (scope, key) procedurali passando dalla cache; i miss vengono
+    letti tutti insieme con una sola chiamata batch alla memoria.
+    """
+    db_id = str(getattr(memory, "db_path", id(memory)))
+    now = time.monotonic()
+
+    results: List[Optional[str]] = [None] * len(lookups)
+    missing: List[int] = []
+    for i, (scope, key) in enumerate(lookups):
+        hit = _SHEET_CACHE.get((db_id, scope.value, key))
+        if hit is not None and now - hit[0] < SHEET_CACHE_TTL:
+            results[i] = hit[1]
+        else:
+            missing.append(i)
+
+    if not missing:
+        return results
+
+    batch = [(lookups[i][1], lookups[i][0], MemoryType.PROCEDURAL) for i in missing]
+    if hasattr(memory, "load_items_content_batch"):
+        raws = memory.load_items_content_batch(batch)
+    else:
+        raws = [
+            memory.load_item_content(key=key, scope=scope, type_=type_)
+            for key, scope, type_ in batch
+        ]
+
+    for i, raw in zip(missing, raws):
+        scope, key = lookups[i]
+        cache_key = (db_id, scope.value, key)
+        _SHEET_CACHE.pop(cache_key, None)
+        if raw:
+            if len(_SHEET_CACHE) >= SHEET_CACHE_MAX_ENTRIES:
+                # via la voce più vecchia (i dict mantengono l'ordine di inserimento)
+                _SHEET_CACHE.pop(next(iter(_SHEET_CACHE)))
+            _SHEET_CACHE[cache_key] = (now, raw)
+        results[i] = raw
+    return results
+
+
+def invalidate_requirements_sheet_cache(key: Optional[str] = None) -> None:
+    """
+    Invalida la cache delle requirements_sheet (tutta, o solo una key).
+    Da chiamare dopo aver scritto una nuova scheda in memoria.
+    """
+    if key is None:
+        _SHEET_CACHE.clear()
+        return
+    for cache_key in [k for k in _SHEET_CACHE if k[2] == key]:
+        del _SHEET_CACHE[cache_key]